@@ -1 +1,4 @@
-from .amocrm import AmoCRMClient
\ No newline at end of file
+from .amocrm import AmoCRMClient
+from .cache import MetadataCache
+from .fields import lead_fields
+from . import models
@@ -1,13 +1,29 @@
 
 import os
+import time
+import random
+import asyncio
 import aiohttp
+from email.utils import parsedate_to_datetime
 from dotenv import load_dotenv
 from loguru import logger
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Callable, AsyncIterator
+
+from .limiter import TokenBucket
+from .models import project_lead
+from .fields import lead_fields
+
+try:
+    import orjson
+except ImportError:  # orjson не обязателен, без него используется json из aiohttp
+    orjson = None
 
 
 load_dotenv()
 
+# Статусы, при которых запрос имеет смысл повторить
+RETRY_STATUSES = {429, 502, 503, 504}
+
 
 class AmoCRMClient:
     def __init__(
@@ -19,6 +35,19 @@ class AmoCRMClient:
         redirect_uri: Optional[str] = None,
         refresh_token: Optional[str] = None,
         permanent_access_token: bool = False,
+        requests_per_second: float = 7,
+        max_concurrency: int = 4,
+        connection_limit: int = 10,
+        keepalive_timeout: float = 75,
+        dns_cache_ttl: int = 600,
+        accept_compression: bool = True,
+        max_retries: int = 5,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30,
+        request_deadline: float = 120,
+        fast_json: bool = True,
+        with_tags: bool = True,
+        project_leads: bool = False,
     ):
         self.base_url = base_url
         self.access_token = access_token
@@ -28,13 +57,65 @@ class AmoCRMClient:
         self.refresh_token = refresh_token
         self.permanent_access_token = permanent_access_token
         self.session: Optional[aiohttp.ClientSession] = None
-        
+        # amoCRM разрешает не более 7 запросов в секунду на интеграцию
+        self.limiter = TokenBucket(requests_per_second)
+        self.max_concurrency = max_concurrency
+        self.connection_limit = connection_limit
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.accept_compression = accept_compression
+        self.connection_stats = {'created': 0, 'reused': 0}
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.request_deadline = request_deadline
+        self._refresh_lock = asyncio.Lock()
+        self.fast_json = fast_json and orjson is not None
+        self.with_tags = with_tags
+        self.project_leads = project_leads
+        self._build_headers()
+
+    def _build_headers(self):
+        """Заголовки собираются один раз на каждый токен, а не на каждый запрос"""
+        self.headers = {
+            "Authorization": f"Bearer {self.access_token}",
+            "Content-Type": "application/json",
+            "Accept-Encoding": "gzip, deflate" if self.accept_compression else "identity",
+        }
+
+    async def _on_connection_create(self, session, context, params):
+        self.connection_stats['created'] += 1
+
+    async def _on_connection_reuse(self, session, context, params):
+        self.connection_stats['reused'] += 1
 
     def start_session(self) -> aiohttp.ClientSession:
-        """Создание aiohttp-сессии"""
-        if self.session is None:
-            self.session = aiohttp.ClientSession()
+        """Создание долгоживущей aiohttp-сессии с пулом keep-alive соединений.
+        Повторный вызов возвращает уже открытую сессию"""
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.connection_limit,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=self.dns_cache_ttl,
+                use_dns_cache=True,
+            )
+            trace_config = aiohttp.TraceConfig()
+            trace_config.on_connection_create_end.append(self._on_connection_create)
+            trace_config.on_connection_reuseconn.append(self._on_connection_reuse)
+            self.session = aiohttp.ClientSession(
+                connector=connector, trace_configs=[trace_config]
+            )
             logger.info("HTTP-сессия для AmoCRM создана.")
+        return self.session
+
+    def log_connection_stats(self):
+        """Логирование статистики переиспользования соединений"""
+        created, reused = self.connection_stats['created'], self.connection_stats['reused']
+        total = created + reused
+        ratio = reused / total * 100 if total else 0
+        logger.info(
+            f"Соединения с AmoCRM: новых {created}, переиспользовано {reused} ({ratio:.0f}%)"
+        )
 
     async def close_session(self):
         """Явное закрытие aiohttp-сессии"""
@@ -43,6 +124,19 @@ class AmoCRMClient:
             logger.info("HTTP-сессия для AmoCRM закрыта.")
             self.session = None
 
+    def _retry_delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Задержка перед повтором: Retry-After от сервера, иначе экспоненциальная с джиттером"""
+        if retry_after:
+            try:
+                return max(0.0, float(retry_after))
+            except ValueError:
+                try:
+                    retry_at = parsedate_to_datetime(retry_after)
+                    return max(0.0, retry_at.timestamp() - time.time())
+                except (TypeError, ValueError):
+                    pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
     async def _make_request(
         self,
         method: str,
@@ -51,48 +145,85 @@ class AmoCRMClient:
         data: Optional[Dict] = None,
         is_expected_html: bool = False
     ):
-        """Приватный метод для выполнения HTTP-запросов к AmoCRM API с обработкой ошибок и логированием"""
+        """Приватный метод для выполнения HTTP-запросов к AmoCRM API с обработкой ошибок и логированием.
+        Ответы 429/502/503/504 и сетевые ошибки повторяются с задержкой, пока не истечёт request_deadline"""
         url = f"{self.base_url}{endpoint}"
 
-        headers = {
-            "Authorization": f"Bearer {self.access_token}",
-            "Content-Type": "application/json",
-        }
-
         logger.debug(
             f"Отправка {method}-запроса на {url} с параметрами: {params} и данными: {data}"
         )
 
-        try:
-            async with self.session.request(
-                method, url, headers=headers, params=params, json=data
-            ) as response:
-                logger.info(
-                    f"Ответ от сервера: статус {response.status} для {method}-запроса на {url}"
-                )
-                if (
-                    response.status == 401 and not self.permanent_access_token
-                ):  # Неавторизован — обновляем токен, если токен не постоянный
-                    logger.warning("Токен истек, попытка обновления.")
-                    await self._refresh_access_token()
-                    return await self._make_request(method, endpoint, params, data)
-                elif response.status == 204: 
-                    # возвращаем пустой json, если NO CONTENT (нет данных для отправки)
-                    return {}
-                elif response.status == 401 and self.permanent_access_token:
-                    # Ошибка авторизации с долгосрочным токеном
-                    logger.error('Долгосрочный токен просрочен или неверно указан!')
-                    return {}
-                response.raise_for_status()  # Генерируем исключение, если статус-код не 200-299
-                if is_expected_html:
-                    return await response.text('utf8')
-                return await response.json()  # Возвращаем JSON ответ
-        except aiohttp.ClientResponseError as e:
-            logger.error(f"Ошибка запроса: {e.status} {e.message}")
-            raise
-        except aiohttp.ClientError as e:
-            logger.error(f"Ошибка сети или соединения: {e}")
-            raise
+        deadline = time.monotonic() + self.request_deadline
+        attempt = 0
+        token_refreshed = False
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logger.error(f"Превышено время ожидания {method}-запроса на {url}")
+                raise asyncio.TimeoutError(f"Превышено время ожидания запроса на {url}")
+            await self.limiter.acquire()
+            used_token = self.access_token
+            delay = None
+            try:
+                async with self.session.request(
+                    method,
+                    url,
+                    headers=self.headers,
+                    params=params,
+                    json=data,
+                    timeout=aiohttp.ClientTimeout(total=remaining)
+                ) as response:
+                    logger.info(
+                        f"Ответ от сервера: статус {response.status} для {method}-запроса на {url}"
+                    )
+                    if (
+                        response.status == 401 and not self.permanent_access_token and not token_refreshed
+                    ):  # Неавторизован — обновляем токен, если токен не постоянный
+                        logger.warning("Токен истек, попытка обновления.")
+                        await self._refresh_access_token_once(used_token)
+                        token_refreshed = True
+                        continue
+                    elif response.status == 204: 
+                        # возвращаем пустой json, если NO CONTENT (нет данных для отправки)
+                        return {}
+                    elif response.status == 401 and self.permanent_access_token:
+                        # Ошибка авторизации с долгосрочным токеном
+                        logger.error('Долгосрочный токен просрочен или неверно указан!')
+                        return {}
+                    elif response.status in RETRY_STATUSES and attempt < self.max_retries:
+                        delay = self._retry_delay(attempt, response.headers.get('Retry-After'))
+                        logger.warning(
+                            f"Статус {response.status} для {url}, повтор через {delay:.1f} с"
+                        )
+                    else:
+                        response.raise_for_status()  # Генерируем исключение, если статус-код не 200-299
+                        if is_expected_html:
+                            return await response.text('utf8')
+                        if self.fast_json:
+                            return orjson.loads(await response.read())
+                        return await response.json()  # Возвращаем JSON ответ
+            except aiohttp.ClientResponseError as e:
+                logger.error(f"Ошибка запроса: {e.status} {e.message}")
+                raise
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                # сетевые ошибки повторяем только для идемпотентных запросов
+                if method != 'GET' or attempt >= self.max_retries:
+                    logger.error(f"Ошибка сети или соединения: {e}")
+                    raise
+                delay = self._retry_delay(attempt)
+                logger.warning(f"Ошибка сети или соединения: {e!r}, повтор через {delay:.1f} с")
+            except aiohttp.ClientError as e:
+                logger.error(f"Ошибка сети или соединения: {e}")
+                raise
+            attempt += 1
+            await asyncio.sleep(min(delay, max(0.0, deadline - time.monotonic())))
+
+    async def _refresh_access_token_once(self, used_token: str):
+        """Обновление токена в единственном экземпляре: при одновременных 401
+        токен обновляет первый запрос, остальные дожидаются его и берут новый токен"""
+        async with self._refresh_lock:
+            if self.access_token == used_token:
+                await self._refresh_access_token()
 
     async def _refresh_access_token(self):
         """Приватный метод для обновления access_token с использованием refresh_token, если токен не постоянный"""
@@ -119,6 +250,7 @@ class AmoCRMClient:
                     tokens = await response.json()
                     self.access_token = tokens["access_token"]
                     self.refresh_token = tokens["refresh_token"]
+                    self._build_headers()
                     logger.info("Токен успешно обновлен.")
                 else:
                     logger.critical(
@@ -129,20 +261,96 @@ class AmoCRMClient:
             logger.error(f"Ошибка при обновлении токена: {e}")
             raise
 
-    async def get_leads(self, start_day: int, end_day: int, pipeline_ids: list, page: int = 1):
+    def _fetch_batch(self, fetch: Callable, first_page: int, args: tuple, kwargs: dict) -> asyncio.Future:
+        pages = range(first_page, first_page + self.max_concurrency)
+        tasks = [asyncio.ensure_future(fetch(*args, page=p, **kwargs)) for p in pages]
+        batch = asyncio.gather(*tasks)
+        batch.add_done_callback(lambda future: self._finish_batch(future, tasks))
+        return batch
+
+    @staticmethod
+    def _finish_batch(batch: asyncio.Future, tasks: list):
+        """Если пачка упала или отменена, остальные страницы отменяются, а исключение
+        считается полученным: пачку могут бросить, не дождавшись (генератор закрыли раньше)"""
+        if not batch.cancelled() and batch.exception() is None:
+            return
+        for task in tasks:
+            task.cancel()
+
+    async def iter_pages(self, fetch: Callable, key: str, *args, **kwargs) -> AsyncIterator[list]:
+        """Асинхронный генератор страниц списка: первая страница запрашивается сразу,
+        остальные — параллельно пачками по max_concurrency с учётом лимита запросов.
+        Следующая пачка загружается, пока вызывающий код обрабатывает текущую"""
+        response = await fetch(*args, page=1, **kwargs)
+        has_next = response.get('_links', {}).get('next', {}).get('href')
+        page = 2
+        batch = self._fetch_batch(fetch, page, args, kwargs) if has_next else None
+        try:
+            yield response.get('_embedded', {}).get(key, [])
+            while batch is not None:
+                responses = await batch
+                page += self.max_concurrency
+                # страницы после последней возвращают 204, т.е. пустой словарь
+                has_next = all(
+                    response.get('_links', {}).get('next', {}).get('href')
+                    for response in responses
+                )
+                batch = self._fetch_batch(fetch, page, args, kwargs) if has_next else None
+                for response in responses:
+                    yield response.get('_embedded', {}).get(key, [])
+        finally:
+            if batch is not None and not batch.done():
+                batch.cancel()
+
+    async def get_all_pages(self, fetch: Callable, key: str, *args, **kwargs) -> list:
+        """Получение всех страниц списка одним списком"""
+        items = []
+        async for page_items in self.iter_pages(fetch, key, *args, **kwargs):
+            items.extend(page_items)
+        return items
+
+    async def get_leads(
+        self,
+        start_day: Optional[int],
+        end_day: Optional[int],
+        pipeline_ids: list,
+        page: int = 1,
+        updated_from: Optional[int] = None
+    ):
+        """Страница сделок; start_day/end_day=None — без фильтра по дате создания"""
         params = {
-            'with': 'tags',
-            'filter[created_at][from]': start_day,
-            'filter[created_at][to]': end_day,
             'page': page
         }
+        if start_day is not None:
+            params['filter[created_at][from]'] = start_day
+        if end_day is not None:
+            params['filter[created_at][to]'] = end_day
+        if self.with_tags:
+            params['with'] = 'tags'
+        if updated_from is not None:
+            params['filter[updated_at][from]'] = updated_from
         for i, pipeline_id in enumerate(pipeline_ids):
             params[f'filter[pipeline_id][{i}]'] = pipeline_id
-        return await self._make_request("GET", f"/api/v4/leads", params=params)
+        response = await self._make_request("GET", f"/api/v4/leads", params=params)
+        return self._project(response)
+
+    def _project(self, response: dict) -> dict:
+        """Оставляет в странице сделок только поля, нужные классификатору"""
+        if not self.project_leads or not response:
+            return response
+        embedded = response.get('_embedded', {})
+        embedded['leads'] = [project_lead(lead) for lead in embedded.get('leads', [])]
+        return response
     
     async def get_pipeline(self, pipeline_id):
         return await self._make_request("GET", f'/api/v4/leads/pipelines/{pipeline_id}')
 
+    async def get_lead_fields(self, page: int = 1):
+        params = {
+            'page': page
+        }
+        return await self._make_request('GET', '/api/v4/leads/custom_fields', params=params)
+
     async def get_users(self, page: int = 1):
         params = {
             'page': page
@@ -162,7 +370,8 @@ class AmoCRMClient:
     async def get_records(self, start_ts, page: int = 1):
         params = {
             'filter[pipeline_id][0]': os.getenv('common_pipe'),
-            'filter[custom_fields_values][693664][from]': start_ts,
+            f'filter[custom_fields_values][{lead_fields.record}][from]': start_ts,
             'page': page
         }
-        return await self._make_request('GET', '/api/v4/leads', params=params)
\ No newline at end of file
+        response = await self._make_request('GET', '/api/v4/leads', params=params)
+        return self._project(response)
\ No newline at end of file
@@ -0,0 +1,56 @@
+import time
+import asyncio
+from loguru import logger
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+class MetadataCache:
+    """In-process кэш редко меняющихся метаданных amoCRM (пользователи, воронки) с TTL.
+    Когда до истечения записи остаётся меньше refresh_ahead от TTL, get отдаёт
+    закэшированное значение и обновляет его в фоне"""
+
+    def __init__(self, ttl: float = 3600, refresh_ahead: float = 0.2):
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self._loaders: Dict[str, Callable[[], Awaitable[Any]]] = {}
+        self._entries: Dict[str, tuple] = {}
+        self._refreshing: Dict[str, asyncio.Task] = {}
+
+    def register(self, key: str, loader: Callable[[], Awaitable[Any]]):
+        self._loaders[key] = loader
+
+    def set(self, key: str, value: Any, stale: bool = False):
+        """Записать значение; stale=True — значение отдаётся, но сразу обновляется в фоне"""
+        expires_at = time.monotonic() + (self.ttl * self.refresh_ahead if stale else self.ttl)
+        self._entries[key] = (expires_at, value)
+
+    async def get(self, key: str) -> Any:
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry is None or entry[0] <= now:
+            return await self.refresh(key)
+        expires_at, value = entry
+        if expires_at - now < self.ttl * self.refresh_ahead and key not in self._refreshing:
+            self._refreshing[key] = asyncio.create_task(self._background_refresh(key))
+        return value
+
+    async def refresh(self, key: str) -> Any:
+        value = await self._loaders[key]()
+        self.set(key, value)
+        logger.info(f'Метаданные `{key}` обновлены')
+        return value
+
+    async def _background_refresh(self, key: str):
+        try:
+            await self.refresh(key)
+        except Exception as ex:
+            logger.warning(f'Не удалось обновить метаданные `{key}` в фоне: {ex}')
+        finally:
+            self._refreshing.pop(key, None)
+
+    def invalidate(self, key: Optional[str] = None):
+        """Сбросить одну запись или весь кэш"""
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
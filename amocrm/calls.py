@@ -0,0 +1,36 @@
+from lxml import html
+
+
+def _has_class(name: str) -> str:
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+ROWS_XPATH = f"//div[{_has_class('calls_analytics_row')}]"
+CALLS_XPATH = f".//div[{_has_class('calls_analytics__calls_graph__all')}]"
+# две строки заголовка сверху и строка итогов снизу
+HEADER_ROWS = 2
+
+
+class CallsAnalytics:
+    count: int
+    total: str
+    managers: dict
+
+    @classmethod
+    def from_html(cls, page: str) -> "CallsAnalytics":
+        """Разбор страницы /stats/calls/: вместо полного дерева BeautifulSoup
+        XPath выбирает только строки аналитики"""
+        self: CallsAnalytics = cls()
+        rows = html.fromstring(page).xpath(ROWS_XPATH)
+        self.count = len(rows) - HEADER_ROWS - 1
+        self.total = cls._calls(rows[-1])
+        self.managers = {}
+        for row in rows[HEADER_ROWS:-1]:
+            name = row.xpath('normalize-space(./div[1])')
+            self.managers[name] = cls._calls(row)
+        return self
+
+    @staticmethod
+    def _calls(row) -> str:
+        cell = row.xpath(CALLS_XPATH)
+        return cell[0].text_content().strip() if cell else ''
@@ -0,0 +1,65 @@
+import os
+from loguru import logger
+from typing import Dict, Optional
+
+
+# Кастомные поля сделки, которые читает классификатор, и их названия в amoCRM
+LEAD_FIELD_NAMES = {
+    'record': 'Время встречи',
+    'reject_reason': 'ЗНР причина',
+}
+# id, которые использовались до появления реестра
+DEFAULT_FIELD_IDS = {
+    'record': 693664,
+}
+
+
+class LeadFields:
+    """Реестр id кастомных полей сделки.
+    id задаются в настройках (`record_field_id`, `reject_reason_field_id`),
+    остальные один раз находятся по названию через /api/v4/leads/custom_fields,
+    поэтому переименование поля в интерфейсе amoCRM не ломает разбор сделок"""
+
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.configured = set()
+        self.load_env()
+
+    def load_env(self):
+        for key in LEAD_FIELD_NAMES:
+            value = os.getenv(f'{key}_field_id')
+            if value:
+                self.ids[key] = int(value)
+                self.configured.add(key)
+            elif key in DEFAULT_FIELD_IDS:
+                self.ids.setdefault(key, DEFAULT_FIELD_IDS[key])
+
+    def resolve(self, fields_json: list) -> Dict[str, int]:
+        """Находит id полей по названию в ответе /api/v4/leads/custom_fields"""
+        by_name = {field.get('name'): field.get('id') for field in fields_json}
+        for key, name in LEAD_FIELD_NAMES.items():
+            if key in self.configured:
+                continue
+            if by_name.get(name) is None:
+                logger.warning(f'Кастомное поле `{name}` не найдено в amoCRM, id: {self.ids.get(key)}')
+                continue
+            self.ids[key] = by_name[name]
+        logger.info(f'id кастомных полей сделки: {self.ids}')
+        return dict(self.ids)
+
+    def update(self, ids: Dict[str, Optional[int]]):
+        """Подставляет id, сохранённые ранее (например, другим процессом)"""
+        for key, value in ids.items():
+            if value is not None and key not in self.configured:
+                self.ids[key] = int(value)
+
+    @property
+    def record(self) -> Optional[int]:
+        return self.ids.get('record')
+
+    @property
+    def reject_reason(self) -> Optional[int]:
+        return self.ids.get('reject_reason')
+
+
+lead_fields = LeadFields()
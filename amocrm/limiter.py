@@ -0,0 +1,23 @@
+import time
+import asyncio
+
+
+class TokenBucket:
+    """Ограничитель частоты запросов по алгоритму token bucket"""
+
+    def __init__(self, rate: float, capacity: int = None):
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+
+    async def acquire(self):
+        """Резервирует токен и ждёт, пока он станет доступен"""
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        # токен резервируется сразу, поэтому блокировка не нужна:
+        # отрицательный баланс — это очередь ожидающих запросов
+        self._tokens -= 1
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self.rate)
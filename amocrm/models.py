@@ -1,6 +1,23 @@
 import re
 import os
 from loguru import logger
+from .fields import lead_fields
+
+
+# Поля сделки, которые читает классификатор; остальное отбрасывается при проекции
+LEAD_FIELDS = ('id', 'status_id', 'pipeline_id', 'created_at', 'updated_at')
+
+
+def project_lead(data: dict) -> dict:
+    """Проекция сделки из /api/v4/leads на поля, нужные для классификации"""
+    lead = {key: data.get(key) for key in LEAD_FIELDS}
+    field_ids = (lead_fields.record, lead_fields.reject_reason)
+    fields = [
+        field for field in data.get('custom_fields_values') or []
+        if field.get('field_id') in field_ids
+    ]
+    lead['custom_fields_values'] = fields or None
+    return lead
 
 
 class Lead:
@@ -53,11 +70,13 @@ class Lead:
 
 class User:
     id: int
+    name: str
     group_id: int
 
     @classmethod
     def from_json(cls, data: dict) -> "User":
         self: User = cls()
         self.id = data.get('id')
+        self.name = data.get('name', '')
         self.group_id = data.get('rights', {}).get('group_id', 0)
         return self
\ No newline at end of file
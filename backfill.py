@@ -0,0 +1,81 @@
+import os
+import sys
+import asyncio
+from datetime import datetime, timedelta
+from loguru import logger
+from dotenv import load_dotenv
+
+from database import Database
+from database.columnar import LeadColumns
+from amocrm import AmoCRMClient, lead_fields
+from kztime import get_today_info, get_local_datetime
+from googlesheet.googlesheets import GoogleSheets
+
+
+load_dotenv()
+
+
+def parse_day(value: str) -> datetime:
+    return get_local_datetime().replace(
+        **dict(zip(('year', 'month', 'day'), map(int, value.split('-'))))
+    )
+
+
+async def main(start_day: datetime, end_day: datetime):
+    """Историческая выгрузка сделок за период: классификация идёт по столбцам NumPy,
+    в БД пишутся готовые строки без ORM-объектов, в таблицу — счётчики из daily_stats"""
+    start_ts, _, _ = get_today_info(start_day)
+    _, end_ts, _ = get_today_info(end_day)
+    pipelines = [int(os.getenv('common_pipe')), int(os.getenv('success_pipe'))]
+    db = Database()
+    amo_client = AmoCRMClient(
+        base_url="https://teslakz.amocrm.ru",
+        access_token=os.getenv("access_token"),
+        client_id=os.getenv("client_id"),
+        client_secret=os.getenv("client_secret"),
+        permanent_access_token=True,
+        with_tags=False,
+        project_leads=True
+    )
+    amo_client.start_session()
+    try:
+        await db.check_tables()
+        statuses = await db.get_statuses()
+        lead_fields.resolve(await amo_client.get_all_pages(amo_client.get_lead_fields, 'custom_fields'))
+        pages = 0
+        async for leads in amo_client.iter_pages(
+            amo_client.get_leads, 'leads', start_ts, end_ts, pipelines
+        ):
+            if not leads:
+                continue
+            columns = LeadColumns.from_leads(leads)
+            columns.classify(statuses)
+            await db.upsert_rows(columns.rows())
+            pages += 1
+        logger.info(f'Выгрузка завершена, страниц: {pages}')
+        # В таблицу идут счётчики из daily_stats: в БД флаги объединены с уже
+        # сохранёнными, удалённые сделки не считаются, а сделка, попавшая на две
+        # страницы, учтена один раз
+        days = [
+            get_today_info(start_day + timedelta(days=i))
+            for i in range((end_day.date() - start_day.date()).days + 1)
+        ]
+        stored = await db.get_statistics(days)
+        google = GoogleSheets()
+        for _, _, local_day in days:
+            google.insert_statistic(stored[local_day], local_day)
+        # строка встреч (10) за тот же период
+        record_statistic, day_count = await db.get_records(start_ts, int(os.getenv('common_pipe')), end_ts)
+        google.insert_records(record_statistic, day_count, days[0][2])
+        google.flush()
+    finally:
+        await amo_client.close_session()
+        await db.dispose()
+
+
+if __name__ == '__main__':
+    # python backfill.py 2025-01-01 2025-03-31
+    if len(sys.argv) < 3:
+        print('Использование: python backfill.py <начало ГГГГ-ММ-ДД> <конец ГГГГ-ММ-ДД>')
+        sys.exit(1)
+    asyncio.run(main(parse_day(sys.argv[1]), parse_day(sys.argv[2])))
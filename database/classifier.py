@@ -0,0 +1,207 @@
+import sys
+import json
+import asyncio
+from pathlib import Path
+from loguru import logger
+from database.registry import StatusRegistry
+from amocrm.fields import lead_fields
+
+
+QUAL = 1
+RECORD = 2
+MEETING = 4
+SELLED = 8
+
+# Классы причины отказа: на правила влияет только принадлежность к этим спискам
+REASON_OTHER = 0
+REASON_NOT_QUALIFIED = 1  # 'Не прошли квал', 'НД'
+REASON_DROPPED = 2  # 'Записались на встречу, но слились'
+REASON_CLASSES = {
+    'Не прошли квал': REASON_NOT_QUALIFIED,
+    'НД': REASON_NOT_QUALIFIED,
+    'Записались на встречу, но слились': REASON_DROPPED,
+}
+LOST_RANK = 11000
+
+
+def get_field_value(field: dict) -> str:
+    """Первое значение кастомного поля из JSON сделки"""
+    try:
+        value = (
+            field["values"][0]["value"]
+            if field["values"][0]["value"] is not None
+            else ""
+        )
+        logger.debug(f"{field.get('field_name','Неизвестное')}: {value}")
+        return value
+    except (KeyError, IndexError, TypeError) as e:
+        logger.warning(
+            f"Ошибка при обработке поля `{field.get('field_name','Неизвестное')}`: {e}"
+        )
+        return "не заполнено"
+
+
+def parse_fields(json_data: dict) -> tuple:
+    """Возвращает (есть ли время встречи, время встречи, причина отказа)"""
+    fields = json_data.get('custom_fields_values')
+    if not fields:
+        return False, None, ''
+    by_id = {field.get('field_id'): field for field in fields}
+    record = by_id.get(lead_fields.record)
+    reason = by_id.get(lead_fields.reject_reason)
+    return (
+        record is not None,
+        get_field_value(record) if record is not None else None,
+        get_field_value(reason) if reason is not None else ''
+    )
+
+
+def cascade(flags: int) -> int:
+    """Продажа ⇒ встреча ⇒ запись ⇒ квалификация"""
+    if flags & SELLED:
+        flags |= MEETING
+    if flags & MEETING:
+        flags |= RECORD
+    if flags & RECORD:
+        flags |= QUAL
+    return flags
+
+
+def classify_reference(json_data: dict, statuses: StatusRegistry) -> int:
+    """Правила Lead.from_json, переписанные поверх StatusRegistry, без таблицы;
+    эталон для verify. С исходным кодом правил сверяется в tests/test_classifier.py"""
+    has_record, _, reject_reason = parse_fields(json_data)
+    status = json_data.get('status_id', '')
+    rank = statuses.rank(json_data.get('pipeline_id', ''), status)
+    flags = RECORD if has_record else 0
+    if (
+        statuses.qual_rank is not None and
+        rank >= statuses.qual_rank and
+        rank != LOST_RANK
+    ) or (
+        rank == LOST_RANK and
+        reject_reason not in ['Не прошли квал', 'НД']
+    ):
+        flags |= QUAL
+    if (
+        status == statuses.decision_status
+    ) or (
+        rank >= statuses.decision_rank and
+        reject_reason not in ['Не прошли квал', 'НД', 'Записались на встречу, но слились']
+    ):
+        flags |= MEETING
+    if rank > 100000:
+        flags |= SELLED
+    return cascade(flags)
+
+
+class LeadClassifier:
+    """Правила классификации, скомпилированные в таблицу
+    (воронка, статус, класс причины отказа) -> флаги для одной версии реестра статусов"""
+
+    def __init__(self, statuses: StatusRegistry):
+        self.statuses = statuses
+        self.version = statuses.version
+        self._table = {}
+        for pipeline_id, status_id in statuses.keys():
+            for reason in (REASON_OTHER, REASON_NOT_QUALIFIED, REASON_DROPPED):
+                self._table[(pipeline_id, status_id, reason)] = self._compile(pipeline_id, status_id, reason)
+
+    def _compile(self, pipeline_id, status_id, reason: int) -> int:
+        statuses = self.statuses
+        rank = statuses.rank(pipeline_id, status_id)
+        flags = 0
+        if (
+            statuses.qual_rank is not None and rank >= statuses.qual_rank and rank != LOST_RANK
+        ) or (
+            rank == LOST_RANK and reason != REASON_NOT_QUALIFIED
+        ):
+            flags |= QUAL
+        if status_id == statuses.decision_status or (
+            rank >= statuses.decision_rank and reason == REASON_OTHER
+        ):
+            flags |= MEETING
+        if rank > 100000:
+            flags |= SELLED
+        return cascade(flags)
+
+    def status_flags(self, pipeline_id, status_id, reason: int) -> int:
+        """Флаги по статусу и классу причины отказа, без учёта времени встречи"""
+        key = (pipeline_id, status_id, reason)
+        flags = self._table.get(key)
+        if flags is None:
+            # статус, которого нет в реестре: считаем один раз и запоминаем
+            flags = self._table[key] = self._compile(*key)
+        return flags
+
+    def flags(self, pipeline_id, status_id, reject_reason: str, has_record: bool) -> int:
+        flags = self.status_flags(pipeline_id, status_id, REASON_CLASSES.get(reject_reason, REASON_OTHER))
+        return flags | (RECORD | QUAL if has_record else 0)
+
+    def classify(self, json_data: dict) -> tuple:
+        """Возвращает (флаги, время встречи) для сырой сделки из amoCRM"""
+        has_record, recorded_at, reject_reason = parse_fields(json_data)
+        flags = self.flags(
+            json_data.get('pipeline_id', ''), json_data.get('status_id', ''), reject_reason, has_record
+        )
+        return flags, recorded_at
+
+    def classify_batch(self, leads: list) -> list:
+        """Классификация пачки сырых сделок за один вызов"""
+        classify = self.classify
+        return [classify(lead) for lead in leads]
+
+
+_compiled: LeadClassifier = None
+
+
+def get_classifier(statuses: StatusRegistry) -> LeadClassifier:
+    """Скомпилированный классификатор для текущей версии реестра статусов"""
+    global _compiled
+    if _compiled is None or _compiled.statuses is not statuses or _compiled.version != statuses.version:
+        _compiled = LeadClassifier(statuses)
+    return _compiled
+
+
+def load_corpus(path: Path) -> list:
+    """Сделки из JSON-файла или каталога: список сделок или страницы ответа /api/v4/leads"""
+    files = sorted(path.glob('*.json')) if path.is_dir() else [path]
+    leads = []
+    for file in files:
+        data = json.loads(file.read_text(encoding='utf8'))
+        pages = data if isinstance(data, list) else [data]
+        for page in pages:
+            if '_embedded' in page:
+                leads.extend(page['_embedded'].get('leads', []))
+            else:
+                leads.append(page)
+    return leads
+
+
+async def verify(path: str) -> int:
+    """Сравнение скомпилированных правил с эталонными на записанном корпусе сделок"""
+    from database import Database
+
+    db = Database()
+    try:
+        statuses = await db.get_statuses()
+    finally:
+        await db.dispose()
+    leads = load_corpus(Path(path))
+    classifier = get_classifier(statuses)
+    mismatches = 0
+    for lead, (flags, _) in zip(leads, classifier.classify_batch(leads)):
+        expected = classify_reference(lead, statuses)
+        if flags != expected:
+            mismatches += 1
+            logger.error(f"Сделка {lead.get('id')}: ожидалось {expected:04b}, получено {flags:04b}")
+    logger.info(f"Проверено сделок: {len(leads)}, расхождений: {mismatches}")
+    return mismatches
+
+
+if __name__ == '__main__':
+    # python -m database.classifier <файл|каталог с JSON сделок>
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    sys.exit(1 if asyncio.run(verify(sys.argv[1])) else 0)
@@ -0,0 +1,116 @@
+import numpy as np
+from database.registry import StatusRegistry
+from database.classifier import (
+    get_classifier, parse_fields, REASON_CLASSES, REASON_OTHER, QUAL, RECORD, MEETING, SELLED
+)
+
+
+NO_VALUE = -1
+
+
+def _int(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return NO_VALUE
+
+
+class LeadColumns:
+    """Столбцовое представление пачки сделок для исторических выгрузок:
+    классификация считается векторно, строки для БД собираются без ORM-объектов"""
+
+    def __init__(self, ids, statuses, pipelines, created_at, updated_at, recorded_at, has_record, reasons):
+        self.ids = ids
+        self.statuses = statuses
+        self.pipelines = pipelines
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.recorded_at = recorded_at
+        self.has_record = has_record
+        self.reasons = reasons
+        self.flags = None
+
+    @classmethod
+    def from_leads(cls, leads: list) -> "LeadColumns":
+        """Разбор сырых сделок из /api/v4/leads в массивы NumPy"""
+        count = len(leads)
+        ids = np.empty(count, dtype=np.int64)
+        statuses = np.empty(count, dtype=np.int64)
+        pipelines = np.empty(count, dtype=np.int64)
+        created_at = np.empty(count, dtype=np.int64)
+        updated_at = np.empty(count, dtype=np.int64)
+        recorded_at = np.full(count, NO_VALUE, dtype=np.int64)
+        has_record = np.zeros(count, dtype=bool)
+        reasons = np.zeros(count, dtype=np.int8)
+        for i, lead in enumerate(leads):
+            ids[i] = lead['id']
+            statuses[i] = _int(lead.get('status_id'))
+            pipelines[i] = _int(lead.get('pipeline_id'))
+            created_at[i] = _int(lead.get('created_at'))
+            updated_at[i] = _int(lead.get('updated_at'))
+            if lead.get('custom_fields_values'):
+                has_record[i], record, reject_reason = parse_fields(lead)
+                recorded_at[i] = _int(record) if has_record[i] else NO_VALUE
+                reasons[i] = REASON_CLASSES.get(reject_reason, REASON_OTHER)
+        return cls(ids, statuses, pipelines, created_at, updated_at, recorded_at, has_record, reasons)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def select(self, mask: np.ndarray) -> "LeadColumns":
+        selected = LeadColumns(
+            self.ids[mask],
+            self.statuses[mask],
+            self.pipelines[mask],
+            self.created_at[mask],
+            self.updated_at[mask],
+            self.recorded_at[mask],
+            self.has_record[mask],
+            self.reasons[mask],
+        )
+        if self.flags is not None:
+            selected.flags = self.flags[mask]
+        return selected
+
+    def classify(self, statuses: StatusRegistry) -> np.ndarray:
+        """Флаги для всех сделок: правила берутся из скомпилированного классификатора
+        для каждой уникальной тройки (воронка, статус, причина), дальше — индексация массивов"""
+        classifier = get_classifier(statuses)
+        keys = np.stack([self.pipelines, self.statuses, self.reasons.astype(np.int64)], axis=1)
+        unique_keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+        unique_flags = np.array(
+            [classifier.status_flags(int(p), int(s), int(r)) for p, s, r in unique_keys],
+            dtype=np.int8
+        )
+        self.flags = unique_flags[inverse.reshape(-1)] | np.where(self.has_record, RECORD | QUAL, 0).astype(np.int8)
+        return self.flags
+
+    def rows(self) -> list:
+        """Строки для Database.upsert_rows"""
+        if self.flags is None:
+            raise ValueError('Сначала нужно вызвать classify')
+        flags = self.flags
+        return [
+            {
+                'id': lead_id,
+                'status': status,
+                'pipeline': pipeline,
+                'recorded_at': None if recorded_at == NO_VALUE else recorded_at,
+                'is_qual': bool(lead_flags & QUAL),
+                'is_record': bool(lead_flags & RECORD),
+                'is_meeting': bool(lead_flags & MEETING),
+                'is_selled': bool(lead_flags & SELLED),
+                'is_deleted': False,
+                'created_at': created_at,
+                'updated_at': updated_at,
+            }
+            for lead_id, status, pipeline, recorded_at, lead_flags, created_at, updated_at in zip(
+                self.ids.tolist(),
+                self.statuses.tolist(),
+                self.pipelines.tolist(),
+                self.recorded_at.tolist(),
+                flags.tolist(),
+                self.created_at.tolist(),
+                self.updated_at.tolist(),
+            )
+        ]
@@ -1,10 +1,28 @@
 import os
+import time
+import datetime
 import sqlalchemy
 from sqlalchemy.sql import func
-from database.models import Base, Lead, Status
+from sqlalchemy.dialects import postgresql, sqlite
+from database.models import Base, Lead, Status, SyncState, Manager, DailyStats, DirtyDay, STAT_FIELDS
 from loguru import logger
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
-from kztime import get_local_datetime
+from database.registry import StatusRegistry
+from kztime import UTC_OFFSET
+from alembic import command
+from alembic.config import Config
+
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), 'migrations')
+# ревизия, соответствующая схеме, которую раньше создавал create_all
+BASELINE_REVISION = '0001'
+# ключ advisory-блокировки PostgreSQL для транзакций, меняющих daily_stats
+STATS_LOCK_KEY = 0x6c656164
+# счётчик изменений таблицы status в sync_state: по нему другие процессы
+# понимают, что реестр статусов пора перезагрузить
+STATUSES_REVISION = 'statuses_revision'
+# номер местных суток (ts + UTC_OFFSET) // 86400 отсчитывается от этой даты
+EPOCH = datetime.date(1970, 1, 1)
 
 
 class Database:
@@ -12,28 +30,54 @@ class Database:
         logger.info(f"Подключение к БД: {os.getenv('db_url')}")
         self.engine = create_async_engine(os.getenv('db_url'), echo=False)
         self.async_session = async_sessionmaker(self.engine, expire_on_commit=False)
+        self.statuses = StatusRegistry()
+        self._statuses_revision = None
         logger.info("Подключение установлено")
 
     async def dispose(self):
         await self.engine.dispose()
 
     async def check_tables(self):
-        async with self.engine.connect() as conn:
-            tables = await conn.run_sync(
-                lambda sync_conn: sqlalchemy.inspect(sync_conn).get_table_names()
+        """Применение недостающих миграций Alembic"""
+        async with self.engine.begin() as conn:
+            await conn.run_sync(self._run_migrations)
+            stats_count = await conn.execute(
+                sqlalchemy.select(func.count()).select_from(DailyStats)
             )
-        if set(tables) != {'lead', 'status'}:
-            logger.info("Таблицы не найдены, создание новых")
-            await self.create_tables()
-        else:
-            Base.metadata.reflect
-            logger.info("Таблицы cуществуют, проверка завершена") 
+            is_stats_empty = stats_count.scalar() == 0
+        if is_stats_empty:
+            await self.rebuild_daily_stats()
+        logger.info("Миграции применены, проверка завершена")
+
+    @staticmethod
+    def _run_migrations(sync_conn):
+        config = Config()
+        config.set_main_option('script_location', MIGRATIONS_DIR)
+        config.attributes['connection'] = sync_conn
+        tables = sqlalchemy.inspect(sync_conn).get_table_names()
+        if 'lead' in tables and 'alembic_version' not in tables:
+            # БД создана через create_all до появления миграций
+            logger.info("Найдена схема без миграций, отметка исходной ревизии")
+            command.stamp(config, BASELINE_REVISION)
+        command.upgrade(config, 'head')
 
     async def create_tables(self):
         async with self.engine.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)
         logger.info("Таблицы успешно созданы")
             
+    async def get_sync_state(self, key: str):
+        async with self.async_session() as session:
+            async with session.begin():
+                state = await session.get(SyncState, key)
+                return state.value if state else None
+
+    async def set_sync_state(self, key: str, value: int):
+        async with self.async_session() as session:
+            async with session.begin():
+                await session.merge(SyncState(key=key, value=value))
+                await session.commit()
+
     async def get_lead_ids(self, from_ts: int, to_ts: int, deleted: bool = False):
         async with self.async_session() as session:
             async with session.begin():
@@ -41,37 +85,131 @@ class Database:
                 result = await session.execute(query)
                 return set(result.scalars().fetchall())
             
-    async def add_lead(self, lead: Lead):
+    async def get_lead_versions(self, from_ts: int, to_ts: int) -> dict:
+        """id → updated_at неудалённых сделок, созданных в периоде"""
         async with self.async_session() as session:
             async with session.begin():
-                session.add(lead)
-                await session.commit()
+                query = sqlalchemy.select(Lead.id, Lead.updated_at).where(
+                    Lead.created_at >= from_ts, Lead.created_at <= to_ts, Lead.is_deleted == False
+                )
+                result = await session.execute(query)
+                return dict(result.tuples().all())
+
+    async def get_existing_lead_ids(self, lead_ids: list):
+        async with self.async_session() as session:
+            async with session.begin():
+                query = sqlalchemy.select(Lead.id).where(Lead.id.in_(lead_ids))
+                result = await session.execute(query)
+                return set(result.scalars().fetchall())
+
+    async def add_lead(self, lead: Lead):
+        await self.upsert_leads([lead])
 
     async def update_lead(self, lead: Lead):
-        statuses = await self.get_statuses()
+        await self.upsert_leads([lead])
+
+    def _insert(self, table):
+        """INSERT с поддержкой ON CONFLICT для диалекта текущей БД"""
+        match self.engine.dialect.name:
+            case 'postgresql':
+                return postgresql.insert(table)
+            case 'sqlite':
+                return sqlite.insert(table)
+            case dialect:
+                raise NotImplementedError(f'UPSERT не поддерживается для диалекта {dialect}')
+
+    async def upsert_leads(self, leads: list):
+        """Добавление и обновление пачки сделок одной транзакцией через INSERT ... ON CONFLICT.
+        Принимает Lead и LeadSnapshot. Сохраняет правила Lead.update_from_lead:
+        флаги только накапливаются (OR), статус меняется только на статус с большим рангом"""
+        await self.upsert_rows([lead.as_row() for lead in leads])
+
+    async def upsert_rows(self, rows: list):
+        """То же, что upsert_leads, но для готовых словарей со столбцами таблицы lead
+        (без создания ORM-объектов)"""
+        if not rows:
+            return
+        query = self._insert(Lead)
+        current, excluded = Lead.__table__.c, query.excluded
+        query = query.on_conflict_do_update(
+            index_elements=[Lead.id],
+            set_={
+                'is_qual': sqlalchemy.or_(current.is_qual, excluded.is_qual),
+                'is_record': sqlalchemy.or_(current.is_record, excluded.is_record),
+                'is_meeting': sqlalchemy.or_(current.is_meeting, excluded.is_meeting),
+                'is_selled': sqlalchemy.or_(current.is_selled, excluded.is_selled),
+                'is_deleted': sqlalchemy.and_(current.is_deleted, excluded.is_deleted),
+                'recorded_at': excluded.recorded_at,
+                'updated_at': excluded.updated_at,
+                # статус с большим рангом выбирается в _keep_higher_status
+                'pipeline': excluded.pipeline,
+                'status': excluded.status,
+            }
+        )
+        lead_ids = [row['id'] for row in rows]
         async with self.async_session() as session:
             async with session.begin():
-                lead_db = await session.get(Lead, lead.id)
-                lead_db.update_from_lead(lead, statuses)
+                await self._lock_stats(session)
+                await self._sync_statuses(session)
+                before = await self._select_stat_rows(session, lead_ids)
+                rows = self._keep_higher_status(rows, before, self.statuses)
+                await session.execute(query, rows)
+                after = await self._select_stat_rows(session, lead_ids)
+                await self._apply_stats_delta(session, before, after)
                 await session.commit()
-            
-    async def get_statuses(self):
+
+    @staticmethod
+    def _keep_higher_status(rows: list, before: dict, statuses: StatusRegistry) -> list:
+        """Для сделок, уже лежащих в БД, оставляет сохранённые воронку и статус,
+        если их ранг не меньше пришедшего (правило Lead.update_from_lead)"""
+        result = []
+        for row in rows:
+            stored = before.get(row['id'])
+            if stored is not None and (
+                statuses.rank(stored['pipeline'], stored['status']) >=
+                statuses.rank(row['pipeline'], row['status'])
+            ):
+                row = {**row, 'pipeline': stored['pipeline'], 'status': stored['status']}
+            result.append(row)
+        return result
+
+    async def get_statuses(self) -> StatusRegistry:
+        """Реестр рангов статусов; из БД перезагружается только после изменения
+        таблицы status (в том числе другим процессом)"""
         async with self.async_session() as session:
             async with session.begin():
-                result = await session.execute(
-                    sqlalchemy.text(
-                        "SELECT * FROM status;"
-                    )
-                )
-                statuses = result.fetchall()
-                st_dict = {}
-                for status in statuses:
-                    _, status_id, pipeline_id, name, sort_type = status
-                    if pipeline_id not in st_dict:
-                        st_dict[pipeline_id] = {}
-                    st_dict[pipeline_id][status_id] = sort_type
-                return st_dict
-    
+                await self._sync_statuses(session)
+        return self.statuses
+
+    async def _sync_statuses(self, session):
+        revision = await session.scalar(
+            sqlalchemy.select(SyncState.value).where(SyncState.key == STATUSES_REVISION)
+        )
+        if not self.statuses.is_loaded or revision != self._statuses_revision:
+            await self._load_statuses(session)
+
+    async def _load_statuses(self, session):
+        self._statuses_revision = await session.scalar(
+            sqlalchemy.select(SyncState.value).where(SyncState.key == STATUSES_REVISION)
+        )
+        result = await session.execute(
+            sqlalchemy.select(Status.status_id, Status.pipeline_id, Status.name, Status.sort_type)
+        )
+        self.statuses.load(result.fetchall())
+        logger.info(f"Реестр статусов загружен, версия {self.statuses.version}")
+
+    async def _lock_stats(self, session):
+        """Сериализует транзакции, меняющие daily_stats, между процессами (опрос
+        и приёмник вебхуков). FOR UPDATE блокирует только существующие строки:
+        без общей блокировки две вставки одной новой сделки видят пустой
+        before и обе прибавляют её к счётчикам"""
+        match self.engine.dialect.name:
+            case 'postgresql':
+                await session.execute(sqlalchemy.select(func.pg_advisory_xact_lock(STATS_LOCK_KEY)))
+            case 'sqlite':
+                # пустой DELETE сразу берёт блокировку записи всей БД
+                await session.execute(sqlalchemy.delete(DirtyDay).where(sqlalchemy.false()))
+
     async def insert_statuses(self, pipeline: dict, is_high_priority: bool = False):
         pipeline_id = pipeline.get('id')
         statuses = pipeline.get('_embedded', {}).get('statuses', [])
@@ -88,170 +226,299 @@ class Database:
                     status = Status.from_json(status_json, is_high_priority)
                     if status.sort_type != -1:
                         session.add(status)
+                query = self._insert(SyncState).values(key=STATUSES_REVISION, value=1)
+                query = query.on_conflict_do_update(
+                    index_elements=[SyncState.key],
+                    set_={'value': SyncState.__table__.c.value + 1}
+                )
+                await session.execute(query)
+                await session.flush()
+                await self._load_statuses(session)
                 await session.commit()
 
-    async def delete_lead(self, lead_id):
+    async def get_managers(self):
         async with self.async_session() as session:
             async with session.begin():
-                query = sqlalchemy.update(Lead).values(is_deleted=True).where(Lead.id==lead_id)
-                await session.execute(query)
+                result = await session.execute(sqlalchemy.select(Manager))
+                return result.scalars().fetchall()
+
+    async def save_managers(self, users: list):
+        async with self.async_session() as session:
+            async with session.begin():
+                await session.execute(sqlalchemy.delete(Manager))
+                for user in users:
+                    session.add(Manager(id=user.id, name=user.name or '', group_id=user.group_id))
                 await session.commit()
 
-    async def get_statistic(self, start_ts, end_ts):
+    async def mark_deleted(self, lead_ids, deleted: bool = True, chunk_size: int = 500):
+        """Пометка пачки сделок удалёнными (или восстановление при deleted=False)
+        одной транзакцией: UPDATE ... WHERE id IN (...) частями по chunk_size"""
+        lead_ids = list(lead_ids)
+        if not lead_ids:
+            return
         async with self.async_session() as session:
             async with session.begin():
-                total = await session.execute(
-                    sqlalchemy.select(
-                        func.count()
-                    ).select_from(
-                        Lead
-                    ).where(
-                        Lead.is_deleted == False,
-                        Lead.created_at >= start_ts,
-                        Lead.created_at <= end_ts
-                    )
-                )
-                qual = await session.execute(
-                    sqlalchemy.select(
-                        func.count()
-                    ).select_from(
-                        Lead
-                    ).where(
-                        Lead.is_deleted == False,
-                        Lead.is_qual == True,
-                        Lead.created_at >= start_ts,
-                        Lead.created_at <= end_ts
-                    )
-                )
-                qual_back = await session.execute(
-                    sqlalchemy.select(
-                        func.count()
-                    ).select_from(
-                        Lead
-                    ).join(
-                        Status, Status.status_id == Lead.status
-                    ).where(
-                        Lead.is_deleted == False,
-                        Lead.is_qual == True,
-                        Lead.created_at >= start_ts,
-                        Lead.created_at <= end_ts,
-                        Status.sort_type < sqlalchemy.select(
-                            Status.sort_type
-                        ).select_from(
-                            Status
-                        ).where(
-                            Status.name == 'Квалификация пройдена'
-                        ).scalar_subquery()
-                    )
-                )
-                record = await session.execute(
-                    sqlalchemy.select(
-                        func.count()
-                    ).select_from(
-                        Lead
-                    ).where(
-                        Lead.is_deleted == False,
-                        Lead.is_record == True,
-                        Lead.created_at >= start_ts,
-                        Lead.created_at <= end_ts
-                    )
-                )
-                record_back = await session.execute(
-                    sqlalchemy.select(
-                        func.count()
-                    ).select_from(
-                        Lead
-                    ).where(
-                        Lead.is_deleted == False,
-                        Lead.is_record == True,
-                        Lead.created_at >= start_ts,
-                        Lead.created_at <= end_ts,
-                        Lead.recorded_at == None
-                    )
-                )
-                meeting = await session.execute(
-                    sqlalchemy.select(
-                        func.count()
-                    ).select_from(
+                await self._lock_stats(session)
+                await self._sync_statuses(session)
+                before = await self._select_stat_rows(session, lead_ids, chunk_size)
+                for i in range(0, len(lead_ids), chunk_size):
+                    query = sqlalchemy.update(
                         Lead
+                    ).values(
+                        is_deleted=deleted
                     ).where(
-                        Lead.is_deleted == False,
-                        Lead.is_meeting == True,
-                        Lead.created_at >= start_ts,
-                        Lead.created_at <= end_ts
+                        Lead.id.in_(lead_ids[i:i + chunk_size])
                     )
+                    await session.execute(query)
+                after = {
+                    lead_id: {**row, 'is_deleted': deleted} for lead_id, row in before.items()
+                }
+                await self._apply_stats_delta(session, before, after)
+                await session.commit()
+        logger.info(f'{"Удалено" if deleted else "Восстановлено"} сделок: {len(lead_ids)}')
+
+    async def delete_lead(self, lead_id):
+        await self.mark_deleted([lead_id])
+
+    async def _select_stat_rows(self, session, lead_ids: list, chunk_size: int = 500) -> dict:
+        """Текущее состояние сделок, от которого зависит их вклад в daily_stats"""
+        rows = {}
+        for i in range(0, len(lead_ids), chunk_size):
+            result = await session.execute(
+                sqlalchemy.select(
+                    Lead.id,
+                    Lead.status,
+                    Lead.pipeline,
+                    Lead.recorded_at,
+                    Lead.is_qual,
+                    Lead.is_record,
+                    Lead.is_meeting,
+                    Lead.is_selled,
+                    Lead.is_deleted,
+                    Lead.created_at
+                ).where(
+                    Lead.id.in_(lead_ids[i:i + chunk_size])
+                ).with_for_update()
+            )
+            for row in result.mappings():
+                rows[row['id']] = dict(row)
+        return rows
+
+    @staticmethod
+    def _contribution(row: dict, statuses: StatusRegistry) -> tuple:
+        """Вклад сделки в счётчики daily_stats (в порядке STAT_FIELDS)"""
+        if row is None or row['is_deleted']:
+            return (0,) * len(STAT_FIELDS)
+        rank = statuses.status_rank(row['status'])
+        qual_threshold, decision_threshold = statuses.qual_passed_rank, statuses.decision_name_rank
+        return (
+            1,
+            int(row['is_qual']),
+            int(bool(row['is_qual']) and rank is not None and qual_threshold is not None and rank < qual_threshold),
+            int(row['is_record']),
+            int(bool(row['is_record']) and row['recorded_at'] is None),
+            int(row['is_meeting']),
+            int(bool(row['is_meeting']) and rank is not None and decision_threshold is not None and rank < decision_threshold),
+            int(row['is_selled']),
+        )
+
+    async def _apply_stats_delta(self, session, before: dict, after: dict):
+        """Применяет к daily_stats разницу вкладов сделок до и после изменения
+        и отмечает затронутые сутки в dirty_day"""
+        if not self.statuses.is_loaded:
+            await self._load_statuses(session)
+        deltas = {}
+        record_days = set()
+        for lead_id in before.keys() | after.keys():
+            old, new = before.get(lead_id), after.get(lead_id)
+            for row, sign in ((old, -1), (new, 1)):
+                if row is None:
+                    continue
+                day = (row['created_at'] + UTC_OFFSET) // 86400
+                contribution = self._contribution(row, self.statuses)
+                delta = deltas.setdefault(day, [0] * len(STAT_FIELDS))
+                for i, value in enumerate(contribution):
+                    delta[i] += sign * value
+            old_record, new_record = self._record_key(old), self._record_key(new)
+            if old_record != new_record:
+                record_days.update(key[0] for key in (old_record, new_record) if key is not None)
+        rows = [
+            {'day': day, **dict(zip(STAT_FIELDS, delta))}
+            for day, delta in deltas.items() if any(delta)
+        ]
+        await self._mark_dirty(session, 'stats', [row['day'] for row in rows])
+        await self._mark_dirty(session, 'records', record_days)
+        if not rows:
+            return
+        query = self._insert(DailyStats)
+        query = query.on_conflict_do_update(
+            index_elements=[DailyStats.day],
+            set_={
+                field: getattr(DailyStats.__table__.c, field) + getattr(query.excluded, field)
+                for field in STAT_FIELDS
+            }
+        )
+        await session.execute(query, rows)
+
+    @staticmethod
+    def _record_key(row: dict):
+        """(сутки встречи, воронка), если сделка попадает в статистику встреч"""
+        if row is None or row['is_deleted'] or row['recorded_at'] is None:
+            return None
+        return (row['recorded_at'] + UTC_OFFSET) // 86400, str(row['pipeline'])
+
+    async def _mark_dirty(self, session, kind: str, days):
+        rows = [{'kind': kind, 'day': day, 'marked_at': time.time()} for day in days]
+        if not rows:
+            return
+        query = self._insert(DirtyDay)
+        query = query.on_conflict_do_update(
+            index_elements=[DirtyDay.kind, DirtyDay.day],
+            set_={'marked_at': query.excluded.marked_at}
+        )
+        await session.execute(query, rows)
+
+    async def get_dirty_days(self, kind: str) -> dict:
+        """Сутки с невыгруженными изменениями: {номер суток: время отметки}"""
+        async with self.async_session() as session:
+            async with session.begin():
+                result = await session.execute(
+                    sqlalchemy.select(DirtyDay.day, DirtyDay.marked_at).where(DirtyDay.kind == kind)
                 )
-                meeting_back = await session.execute(
-                    sqlalchemy.select(
-                        func.count()
-                    ).select_from(
-                        Lead
-                    ).join(
-                        Status, Status.status_id == Lead.status
-                    ).where(
-                        Lead.is_deleted == False,
-                        Lead.is_meeting == True,
-                        Lead.created_at >= start_ts,
-                        Lead.created_at <= end_ts,
-                        Status.sort_type < sqlalchemy.select(
-                            Status.sort_type
-                        ).select_from(
-                            Status
-                        ).where(
-                            Status.name == 'Принимает решение'
-                        ).scalar_subquery()
+                return dict(result.tuples().all())
+
+    async def clear_dirty_days(self, kind: str, dirty: dict):
+        """Снимает отметки, полученные из get_dirty_days; сутки, отмеченные
+        повторно после этого (например, приёмником вебхуков), остаются"""
+        if not dirty:
+            return
+        async with self.async_session() as session:
+            async with session.begin():
+                for day, marked_at in dirty.items():
+                    await session.execute(
+                        sqlalchemy.delete(DirtyDay).where(
+                            DirtyDay.kind == kind,
+                            DirtyDay.day == day,
+                            DirtyDay.marked_at <= marked_at
+                        )
                     )
-                )
-                
-                selled = await session.execute(
-                    sqlalchemy.select(
-                        func.count()
-                    ).select_from(
-                        Lead
-                    ).where(
-                        Lead.is_deleted == False,
-                        Lead.is_selled == True,
-                        Lead.created_at >= start_ts,
-                        Lead.created_at <= end_ts
+                await session.commit()
+
+    async def rebuild_daily_stats(self):
+        """Полный пересчёт daily_stats по таблице lead (нужен после смены рангов статусов)"""
+        async with self.async_session() as session:
+            async with session.begin():
+                await self._lock_stats(session)
+                await session.execute(sqlalchemy.delete(DailyStats))
+                await session.execute(
+                    sqlalchemy.insert(DailyStats).from_select(
+                        ['day', *STAT_FIELDS], self._statistics_query()
                     )
                 )
-                return (
-                    total.scalars().first(),
-                    qual.scalars().first(),
-                    qual_back.scalars().first(),
-                    record.scalars().first(),
-                    record_back.scalars().first(),
-                    meeting.scalars().first(),
-                    meeting_back.scalars().first(),
-                    selled.scalars().first()
-                )
-            
-    async def get_records(self, start_ts: int):
+                await session.commit()
+        logger.info("Статистика по дням пересчитана")
+
+    @staticmethod
+    def _statistics_query(start_ts: int = None, end_ts: int = None):
+        """Агрегирующий запрос статистики по местным суткам"""
+        local_day = (Lead.created_at + UTC_OFFSET) // 86400
+        status_rank = sqlalchemy.select(
+            Status.status_id, func.min(Status.sort_type).label('rank')
+        ).group_by(
+            Status.status_id
+        ).subquery()
+
+        def threshold(name: str):
+            return sqlalchemy.select(
+                func.min(Status.sort_type)
+            ).where(
+                Status.name == name
+            ).scalar_subquery()
+
+        def count_if(*conditions):
+            return func.sum(sqlalchemy.case((sqlalchemy.and_(*conditions), 1), else_=0))
+
+        query = sqlalchemy.select(
+            local_day,
+            func.count(),
+            count_if(Lead.is_qual == True),
+            count_if(Lead.is_qual == True, status_rank.c.rank < threshold('Квалификация пройдена')),
+            count_if(Lead.is_record == True),
+            count_if(Lead.is_record == True, Lead.recorded_at == None),
+            count_if(Lead.is_meeting == True),
+            count_if(Lead.is_meeting == True, status_rank.c.rank < threshold('Принимает решение')),
+            count_if(Lead.is_selled == True)
+        ).select_from(
+            Lead
+        ).outerjoin(
+            status_rank, status_rank.c.status_id == sqlalchemy.cast(Lead.status, sqlalchemy.Integer)
+        ).where(
+            Lead.is_deleted == False
+        ).group_by(
+            local_day
+        )
+        if start_ts is not None:
+            query = query.where(Lead.created_at >= start_ts)
+        if end_ts is not None:
+            query = query.where(Lead.created_at <= end_ts)
+        return query
+
+    async def get_statistics(self, days: list) -> dict:
+        """Статистика сразу за несколько дней из daily_stats (поиск по первичному ключу).
+        days — список (start_ts, end_ts, day) как из get_today_info;
+        возвращает {day: (total, qual, qual_back, record, record_back, meeting, meeting_back, selled)}"""
+        if not days:
+            return {}
+        day_keys = {(start_ts + UTC_OFFSET) // 86400: day for start_ts, _, day in days}
         async with self.async_session() as session:
             async with session.begin():
-                sql_response = await session.execute(
-                    sqlalchemy.select(
-                        Lead.recorded_at
-                    ).select_from(
-                        Lead
-                    ).where(
-                        Lead.recorded_at >= start_ts
-                    )
+                result = await session.execute(
+                    sqlalchemy.select(DailyStats).where(DailyStats.day.in_(day_keys))
                 )
-                records = sql_response.scalars().fetchall()  
-                record_statistic = {}   
-                day_count = 0      
-                for record in records:
-                    local_record = get_local_datetime(record)
-                    if local_record.year not in record_statistic:
-                        record_statistic[local_record.year] = {}
-                    if local_record.month not in record_statistic[local_record.year]:
-                        record_statistic[local_record.year][local_record.month] = {}
-                    if local_record.day not in record_statistic[local_record.year][local_record.month]:
-                        day_count += 1
-                        record_statistic[local_record.year][local_record.month][local_record.day] = 0
-                    record_statistic[local_record.year][local_record.month][local_record.day] += 1
-                return record_statistic, day_count
+                rows = {
+                    stats.day: tuple(getattr(stats, field) for field in STAT_FIELDS)
+                    for stats in result.scalars()
+                }
+        return {
+            day: rows.get(key, (0,) * len(STAT_FIELDS))
+            for key, day in day_keys.items()
+        }
+
+    async def get_statistic(self, start_ts, end_ts):
+        statistics = await self.get_statistics([(start_ts, end_ts, start_ts)])
+        return statistics[start_ts]
+
+    @staticmethod
+    def _records_query(start_ts: int, pipeline_id: int = None, end_ts: int = None):
+        """Гистограмма встреч по местным суткам; идёт по индексу ix_lead_recorded_at"""
+        local_day = (Lead.recorded_at + UTC_OFFSET) // 86400
+        query = sqlalchemy.select(
+            local_day, func.count()
+        ).where(
+            Lead.recorded_at >= start_ts,
+            Lead.is_deleted == False
+        ).group_by(
+            local_day
+        )
+        if end_ts is not None:
+            query = query.where(Lead.recorded_at <= end_ts)
+        if pipeline_id is not None:
+            query = query.where(sqlalchemy.cast(Lead.pipeline, sqlalchemy.Integer) == pipeline_id)
+        return query
+
+    async def get_records(self, start_ts: int, pipeline_id: int = None, end_ts: int = None):
+        """Количество назначенных встреч по местным суткам с start_ts (по end_ts, если задан);
+        возвращает ({год: {месяц: {день: количество}}}, число дней со встречами)"""
+        query = self._records_query(start_ts, pipeline_id, end_ts)
+        async with self.async_session() as session:
+            async with session.begin():
+                result = await session.execute(query)
+                histogram = result.tuples().all()
+        record_statistic = {}
+        for day_index, count in histogram:
+            day = EPOCH + datetime.timedelta(days=day_index)
+            record_statistic.setdefault(day.year, {}).setdefault(day.month, {})[day.day] = count
+        return record_statistic, len(histogram)
 
 
 # async def test():
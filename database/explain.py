@@ -0,0 +1,99 @@
+import os
+import sys
+import random
+import asyncio
+import sqlalchemy
+from loguru import logger
+
+
+# По умолчанию используется отдельная локальная БД, чтобы не трогать рабочую
+os.environ['db_url'] = os.getenv('explain_db_url', 'sqlite+aiosqlite:///explain.db')
+
+from database import Database
+from database.models import Lead, Status, DailyStats
+from kztime import UTC_OFFSET
+from kztime import get_last_week_list, get_today_info
+
+
+async def seed(db: Database, count: int):
+    """Заполнение пустой БД синтетическими сделками за последние ~3 года"""
+    async with db.async_session() as session:
+        async with session.begin():
+            exists = await session.execute(sqlalchemy.select(sqlalchemy.func.count()).select_from(Lead))
+            if exists.scalar():
+                return
+    logger.info(f'Заполнение БД: {count} сделок')
+    now = int(get_today_info()[1])
+    statuses = [(1000 + i, i * 10) for i in range(12)]
+    async with db.async_session() as session:
+        async with session.begin():
+            await session.execute(
+                sqlalchemy.insert(Status),
+                [
+                    {'status_id': status_id, 'pipeline_id': 1, 'name': f'Статус {sort}', 'sort_type': sort}
+                    for status_id, sort in statuses
+                ]
+            )
+            batch = []
+            for lead_id in range(1, count + 1):
+                created_at = now - random.randint(0, 3 * 365 * 86400)
+                status_id, sort = random.choice(statuses)
+                batch.append({
+                    'id': lead_id,
+                    'status': status_id,
+                    'pipeline': 1,
+                    'recorded_at': created_at + random.randint(0, 14 * 86400) if sort >= 50 else None,
+                    'is_qual': sort >= 50,
+                    'is_record': sort >= 60,
+                    'is_meeting': sort >= 80,
+                    'is_selled': sort >= 100,
+                    'is_deleted': random.random() < 0.05,
+                    'created_at': created_at,
+                    'updated_at': created_at,
+                })
+                if len(batch) == 10000:
+                    await session.execute(sqlalchemy.insert(Lead), batch)
+                    batch = []
+            if batch:
+                await session.execute(sqlalchemy.insert(Lead), batch)
+    await db.rebuild_daily_stats()
+    async with db.engine.begin() as conn:
+        await conn.execute(sqlalchemy.text('ANALYZE'))
+
+
+def hot_queries():
+    week = [get_today_info(day) for day in get_last_week_list()]
+    start_ts, end_ts = week[-1][0], week[0][1]
+    return {
+        'get_lead_ids': sqlalchemy.select(Lead.id).where(
+            Lead.created_at >= start_ts, Lead.created_at <= end_ts, Lead.is_deleted == False
+        ),
+        'get_statistics': sqlalchemy.select(DailyStats).where(
+            DailyStats.day.in_([(day_start + UTC_OFFSET) // 86400 for day_start, _, _ in week])
+        ),
+        'rebuild_daily_stats': Database._statistics_query(start_ts, end_ts),
+        'get_records': Database._records_query(start_ts, int(os.getenv('common_pipe', 0))),
+        'status_by_name': sqlalchemy.select(Status.sort_type).where(Status.name == 'Квалификация пройдена'),
+    }
+
+
+async def explain(count: int):
+    db = Database()
+    try:
+        await db.check_tables()
+        await seed(db, count)
+        prefix = 'EXPLAIN QUERY PLAN' if db.engine.dialect.name == 'sqlite' else 'EXPLAIN ANALYZE'
+        async with db.engine.connect() as conn:
+            for name, query in hot_queries().items():
+                sql = query.compile(db.engine, compile_kwargs={'literal_binds': True})
+                result = await conn.execute(sqlalchemy.text(f'{prefix} {sql}'))
+                print(f'--- {name}')
+                for row in result.fetchall():
+                    print('   ', row[-1])
+    finally:
+        await db.dispose()
+
+
+if __name__ == '__main__':
+    # python -m database.explain [количество сделок]
+    asyncio.run(explain(int(sys.argv[1]) if len(sys.argv) > 1 else 500000))
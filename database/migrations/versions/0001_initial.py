@@ -0,0 +1,52 @@
+"""Исходная схема: lead, status, managers
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 12:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'lead',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('pipeline', sa.String(), nullable=False),
+        sa.Column('recorded_at', sa.Integer(), nullable=True),
+        sa.Column('is_qual', sa.Boolean(), nullable=False),
+        sa.Column('is_record', sa.Boolean(), nullable=False),
+        sa.Column('is_meeting', sa.Boolean(), nullable=False),
+        sa.Column('is_selled', sa.Boolean(), nullable=False),
+        sa.Column('is_deleted', sa.Boolean(), nullable=False),
+        sa.Column('created_at', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.Integer(), nullable=False),
+    )
+    op.create_table(
+        'status',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('status_id', sa.Integer(), nullable=False),
+        sa.Column('pipeline_id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('sort_type', sa.Integer(), nullable=False),
+    )
+    op.create_table(
+        'managers',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('group_id', sa.Integer(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table('managers')
+    op.drop_table('status')
+    op.drop_table('lead')
@@ -0,0 +1,30 @@
+"""Таблица sync_state для водяного знака инкрементальной синхронизации
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 12:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # таблица могла быть уже создана через create_all до появления миграций
+    if 'sync_state' in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table(
+        'sync_state',
+        sa.Column('key', sa.String(), primary_key=True),
+        sa.Column('value', sa.Integer(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table('sync_state')
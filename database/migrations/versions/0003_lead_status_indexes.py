@@ -0,0 +1,40 @@
+"""Индексы под горячие запросы к lead и status
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 12:00:00
+
+"""
+from alembic import op
+
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # окно по created_at с фильтром is_deleted (get_lead_ids, get_statistics);
+    # в PostgreSQL индекс покрывающий, в SQLite id входит в индекс как rowid
+    op.create_index(
+        'ix_lead_is_deleted_created_at',
+        'lead',
+        ['is_deleted', 'created_at'],
+        postgresql_include=['status', 'recorded_at', 'is_qual', 'is_record', 'is_meeting', 'is_selled'],
+    )
+    # гистограмма записей на встречу
+    op.create_index('ix_lead_recorded_at', 'lead', ['recorded_at'])
+    # ранг статуса по status_id (статистика) и по паре воронка/статус (upsert)
+    op.create_index('ix_status_status_id_sort_type', 'status', ['status_id', 'sort_type'])
+    op.create_index('ix_status_pipeline_id_status_id', 'status', ['pipeline_id', 'status_id', 'sort_type'])
+    # пороговые статусы по имени
+    op.create_index('ix_status_name', 'status', ['name', 'sort_type'])
+
+
+def downgrade():
+    op.drop_index('ix_status_name', 'status')
+    op.drop_index('ix_status_pipeline_id_status_id', 'status')
+    op.drop_index('ix_status_status_id_sort_type', 'status')
+    op.drop_index('ix_lead_recorded_at', 'lead')
+    op.drop_index('ix_lead_is_deleted_created_at', 'lead')
@@ -0,0 +1,31 @@
+"""Материализованная статистика по дням daily_stats
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 12:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # заполняется в Database.check_tables через rebuild_daily_stats
+    op.create_table(
+        'daily_stats',
+        sa.Column('day', sa.Integer(), primary_key=True, autoincrement=False),
+        *[
+            sa.Column(name, sa.Integer(), nullable=False)
+            for name in ('total', 'qual', 'qual_back', 'record', 'record_back', 'meeting', 'meeting_back', 'selled')
+        ],
+    )
+
+
+def downgrade():
+    op.drop_table('daily_stats')
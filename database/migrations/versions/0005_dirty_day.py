@@ -0,0 +1,28 @@
+"""Сутки с изменениями, ещё не выгруженные в Google Sheets
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 13:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'dirty_day',
+        sa.Column('kind', sa.String(), primary_key=True),
+        sa.Column('day', sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column('marked_at', sa.Float(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table('dirty_day')
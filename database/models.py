@@ -1,6 +1,7 @@
-import os
+from sqlalchemy import Index
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from loguru import logger
+from database.registry import StatusRegistry
+from database.classifier import get_classifier, QUAL, RECORD, MEETING, SELLED
 
 class Base(DeclarativeBase):
     pass
@@ -8,6 +9,15 @@ class Base(DeclarativeBase):
 
 class Lead(Base):
     __tablename__ = "lead"
+    __table_args__ = (
+        Index(
+            'ix_lead_is_deleted_created_at',
+            'is_deleted',
+            'created_at',
+            postgresql_include=['status', 'recorded_at', 'is_qual', 'is_record', 'is_meeting', 'is_selled']
+        ),
+        Index('ix_lead_recorded_at', 'recorded_at'),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     status: Mapped[str] = mapped_column()
@@ -21,106 +31,105 @@ class Lead(Base):
     created_at: Mapped[int] = mapped_column()
     updated_at: Mapped[int] = mapped_column()
     
-    def __get_value_from_json(self, field: dict, _all: bool = False) -> str:
-        """Приватный метод для получения значения из JSON"""
-        try:
-            if not _all:
-                value = (
-                    field["values"][0]["value"]
-                    if field["values"][0]["value"] is not None
-                    else ""
-                )
-            else:
-                value = ", ".join(
-                    [
-                        value["value"]
-                        for value in field["values"]
-                        if value["value"] is not None
-                    ]
-                )
-            logger.debug(f"{field.get('field_name','Неизвестное')}: {value}")
-            return value
-        except (KeyError, IndexError, TypeError) as e:
-            logger.warning(
-                f"Ошибка при обработке поля `{field.get('field_name','Неизвестное')}`: {e}"
-            )
-            return "не заполнено"
-
     @classmethod
-    def from_json(cls, json_data: dict, statuses: dict):
+    def from_json(cls, json_data: dict, statuses: StatusRegistry):
         self : Lead = cls()
         self.id = json_data.get('id', '')
         self.status = json_data.get('status_id', '')
         self.pipeline = json_data.get('pipeline_id', '')
         self.created_at = json_data.get('created_at', '')
         self.updated_at = json_data.get('updated_at', '')
-        self.recorded_at = None
-        reject_reason = ''
         self.is_deleted = False
-        self.is_record = False
-        self.is_meeting = False
-        self.is_selled = False
-        self.is_qual = False
-
-        fields = json_data.get('custom_fields_values', [])
-        if not fields:
-            fields = [] 
-        for field in fields:
-            match field.get("field_name", None):
-                case 'Время встречи':
-                    self.is_record = True
-                    self.recorded_at = self.__get_value_from_json(field)
-                case 'ЗНР причина':
-                    reject_reason = self.__get_value_from_json(field)
-                case _:
-                    continue
-        if (
-            statuses.get(self.pipeline, {}).get(self.status, -1) >= statuses.get(int(os.getenv('common_pipe')), {}).get(int(os.getenv('qual_status', 50))) and 
-            statuses.get(self.pipeline, {}).get(self.status, -1) != 11000
-        ) or (
-            statuses.get(self.pipeline, {}).get(self.status, -1) == 11000 and
-            reject_reason not in ['Не прошли квал', 'НД'] 
-        ):
-            self.is_qual = True
-        if (
-            self.status == int(os.getenv('decision_status'))
-        ) or (
-            (
-                statuses.get(self.pipeline, {}).get(self.status, -1) >= statuses.get(int(os.getenv('common_pipe')), {}).get(int(os.getenv('decision_status')), 80)
-            ) and (
-                reject_reason not in ['Не прошли квал', 'НД', 'Записались на встречу, но слились']
-            )
-        ):
-            self.is_meeting = True
-        if statuses.get(self.pipeline, {}).get(self.status, -1) > 100000:
-            self.is_selled = True
-
-        if self.is_selled:
-            self.is_meeting = True
-        if self.is_meeting:
-            self.is_record = True
-        if self.is_record:
-            self.is_qual = True
-        
+        flags, self.recorded_at = get_classifier(statuses).classify(json_data)
+        self.is_qual = bool(flags & QUAL)
+        self.is_record = bool(flags & RECORD)
+        self.is_meeting = bool(flags & MEETING)
+        self.is_selled = bool(flags & SELLED)
         return self
     
-    def update_from_lead(self, lead: 'Lead', statuses: dict):
+    def update_from_lead(self, lead: 'Lead', statuses: StatusRegistry):
         self.is_qual |= lead.is_qual
         self.is_meeting |= lead.is_meeting
         self.is_record |= lead.is_record
         self.is_selled |= lead.is_selled
         self.is_deleted &= lead.is_deleted
         self.recorded_at = lead.recorded_at
-        if statuses.get(self.pipeline, {}).get(self.status, -1) < statuses.get(lead.pipeline, {}).get(lead.status, -1) :
+        if statuses.rank(self.pipeline, self.status) < statuses.rank(lead.pipeline, lead.status):
             self.pipeline = lead.pipeline
             self.status = lead.status
         
+    def as_row(self) -> dict:
+        return {column: getattr(self, column) for column in LEAD_COLUMNS}
+
     def __str__(self):
         return f'id: {self.id}; pipeline: {self.pipeline}; status: {self.status}'
-    
+
+
+LEAD_COLUMNS = (
+    'id', 'status', 'pipeline', 'recorded_at', 'is_qual', 'is_record',
+    'is_meeting', 'is_selled', 'is_deleted', 'created_at', 'updated_at'
+)
+
+
+class LeadSnapshot:
+    """Классифицированная сделка из amoCRM без ORM-инструментирования.
+    Живёт только в цикле синхронизации: сравнивается с БД и пишется через
+    upsert_leads одним INSERT ... ON CONFLICT, если что-то изменилось"""
+    __slots__ = ('id', 'status', 'pipeline', 'created_at', 'updated_at', 'recorded_at', 'flags')
+    is_deleted = False
+
+    def __init__(self, id, status, pipeline, created_at, updated_at, recorded_at, flags: int):
+        self.id = id
+        self.status = status
+        self.pipeline = pipeline
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.recorded_at = recorded_at
+        self.flags = flags
+
+    @classmethod
+    def from_json(cls, json_data: dict, statuses: StatusRegistry) -> 'LeadSnapshot':
+        flags, recorded_at = get_classifier(statuses).classify(json_data)
+        return cls(
+            json_data.get('id', ''),
+            json_data.get('status_id', ''),
+            json_data.get('pipeline_id', ''),
+            json_data.get('created_at', ''),
+            json_data.get('updated_at', ''),
+            recorded_at,
+            flags
+        )
+
+    @property
+    def is_qual(self) -> bool:
+        return bool(self.flags & QUAL)
+
+    @property
+    def is_record(self) -> bool:
+        return bool(self.flags & RECORD)
+
+    @property
+    def is_meeting(self) -> bool:
+        return bool(self.flags & MEETING)
+
+    @property
+    def is_selled(self) -> bool:
+        return bool(self.flags & SELLED)
+
+    def as_row(self) -> dict:
+        return {column: getattr(self, column) for column in LEAD_COLUMNS}
+
+    def __repr__(self):
+        return f'LeadSnapshot(id={self.id}, pipeline={self.pipeline}, status={self.status}, flags={self.flags:04b})'
+
 
 class Status(Base):
     __tablename__ = "status"
+    __table_args__ = (
+        Index('ix_status_status_id_sort_type', 'status_id', 'sort_type'),
+        Index('ix_status_pipeline_id_status_id', 'pipeline_id', 'status_id', 'sort_type'),
+        Index('ix_status_name', 'name', 'sort_type'),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     status_id: Mapped[int] = mapped_column()
@@ -139,6 +148,41 @@ class Status(Base):
         return self
 
 
+STAT_FIELDS = ('total', 'qual', 'qual_back', 'record', 'record_back', 'meeting', 'meeting_back', 'selled')
+
+
+class DailyStats(Base):
+    """Счётчики статистики по местным суткам; day — номер суток (created_at + UTC_OFFSET) // 86400"""
+    __tablename__ = "daily_stats"
+
+    day: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    total: Mapped[int] = mapped_column(default=0)
+    qual: Mapped[int] = mapped_column(default=0)
+    qual_back: Mapped[int] = mapped_column(default=0)
+    record: Mapped[int] = mapped_column(default=0)
+    record_back: Mapped[int] = mapped_column(default=0)
+    meeting: Mapped[int] = mapped_column(default=0)
+    meeting_back: Mapped[int] = mapped_column(default=0)
+    selled: Mapped[int] = mapped_column(default=0)
+
+
+class DirtyDay(Base):
+    """Местные сутки, статистика которых изменилась и ещё не выгружена в таблицу.
+    kind — 'stats' (сутки по created_at) или 'records' (сутки по recorded_at)"""
+    __tablename__ = "dirty_day"
+
+    kind: Mapped[str] = mapped_column(primary_key=True)
+    day: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    marked_at: Mapped[float] = mapped_column()
+
+
+class SyncState(Base):
+    __tablename__ = "sync_state"
+
+    key: Mapped[str] = mapped_column(primary_key=True)
+    value: Mapped[int] = mapped_column()
+
+
 class Manager(Base):
     __tablename__ = "managers"
 
@@ -0,0 +1,65 @@
+import os
+import time
+
+
+QUAL_PASSED_NAME = 'Квалификация пройдена'
+DECISION_NAME = 'Принимает решение'
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class StatusRegistry:
+    """Ранги (sort_type) статусов воронок в памяти.
+    Загружается из таблицы status один раз и перезагружается только после insert_statuses;
+    version растёт при каждой загрузке, по нему сбрасываются производные кэши"""
+
+    def __init__(self):
+        self.version = 0
+        self.loaded_at = 0.0
+        self._ranks = {}
+        self._status_ranks = {}
+        self.qual_passed_rank = None
+        self.decision_name_rank = None
+        self.qual_rank = None
+        self.decision_rank = None
+        self.decision_status = None
+
+    @property
+    def is_loaded(self) -> bool:
+        return self.version > 0
+
+    def load(self, rows):
+        """rows — строки (status_id, pipeline_id, name, sort_type)"""
+        ranks, status_ranks, name_ranks = {}, {}, {}
+        for status_id, pipeline_id, name, sort_type in rows:
+            ranks[(pipeline_id, status_id)] = sort_type
+            status_ranks[status_id] = min(status_ranks.get(status_id, sort_type), sort_type)
+            name_ranks[name] = min(name_ranks.get(name, sort_type), sort_type)
+        self._ranks = ranks
+        self._status_ranks = status_ranks
+        self.qual_passed_rank = name_ranks.get(QUAL_PASSED_NAME)
+        self.decision_name_rank = name_ranks.get(DECISION_NAME)
+        # пороги из настроек: ранги статусов квалификации и решения в общей воронке
+        common_pipe = _to_int(os.getenv('common_pipe'))
+        self.qual_rank = ranks.get((common_pipe, _to_int(os.getenv('qual_status', 50))))
+        self.decision_status = _to_int(os.getenv('decision_status'))
+        self.decision_rank = ranks.get((common_pipe, self.decision_status), 80)
+        self.version += 1
+        self.loaded_at = time.monotonic()
+
+    def keys(self):
+        """Известные пары (воронка, статус)"""
+        return self._ranks.keys()
+
+    def rank(self, pipeline_id, status_id, default: int = -1) -> int:
+        """Ранг статуса в воронке; default, если статус неизвестен"""
+        return self._ranks.get((_to_int(pipeline_id), _to_int(status_id)), default)
+
+    def status_rank(self, status_id):
+        """Минимальный ранг статуса по его id без учёта воронки (как при JOIN по status_id)"""
+        return self._status_ranks.get(_to_int(status_id))
@@ -8,6 +8,9 @@ from kztime import get_last_week_list, get_today_info
 
 load_dotenv()
 
+# ключ из main.SHEETS_FULL_REFRESH: 0 — в следующем цикле выгрузить всю неделю
+SHEETS_FULL_REFRESH = 'sheets_full_refresh_at'
+
 
 async def main():
     week = get_last_week_list()
@@ -25,7 +28,10 @@ async def main():
                     }
                 )
             )
-
+    # UPDATE в обход upsert не меняет daily_stats и dirty_day
+    await db.rebuild_daily_stats()
+    await db.set_sync_state(SHEETS_FULL_REFRESH, 0)
+    await db.dispose()
 
 
 if __name__ == '__main__':
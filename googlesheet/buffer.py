@@ -0,0 +1,42 @@
+import gspread
+from loguru import logger
+from gspread.utils import absolute_range_name
+
+
+class WriteBuffer:
+    """Накопитель записей в Google Sheets.
+    Диапазоны со всех листов копятся до flush и уходят одним
+    values.batchUpdate на таблицу; повторная запись в тот же диапазон
+    заменяет предыдущую"""
+
+    def __init__(self):
+        self._spreadsheets = {}
+        self._ranges = {}
+
+    def add(self, ws: gspread.Worksheet, cell_range: str, values: list):
+        spreadsheet_id = ws.spreadsheet_id
+        self._spreadsheets[spreadsheet_id] = ws.spreadsheet
+        ranges = self._ranges.setdefault(spreadsheet_id, {})
+        ranges[absolute_range_name(ws.title, cell_range)] = values
+
+    def __len__(self):
+        return sum(len(ranges) for ranges in self._ranges.values())
+
+    def flush(self):
+        """Отправка накопленных диапазонов; при ошибке буфер всё равно очищается,
+        а исключение пробрасывается, чтобы данные пересчитались в следующем цикле"""
+        try:
+            for spreadsheet_id, ranges in self._ranges.items():
+                if not ranges:
+                    continue
+                self._spreadsheets[spreadsheet_id].values_batch_update({
+                    'valueInputOption': 'USER_ENTERED',
+                    'data': [
+                        {'range': cell_range, 'values': values}
+                        for cell_range, values in ranges.items()
+                    ]
+                })
+                logger.info(f'Записано диапазонов в таблицу {spreadsheet_id}: {len(ranges)}')
+        finally:
+            self._ranges.clear()
+            self._spreadsheets.clear()
@@ -1,9 +1,9 @@
 import os
-import time
 import gspread
 import datetime
 from loguru import logger
 from googlesheet.template_generator import TemplateGenerator
+from googlesheet.buffer import WriteBuffer
 from gspread_formatting import set_frozen, set_column_width
 
 
@@ -15,29 +15,40 @@ class GoogleSheets:
             logger.info("Инициализация GoogleSheets")
             self.gc = gspread.service_account(filename="credentials.json")
             self.table = self.gc.open_by_key(os.getenv("table_id"))
+            # insert_statistic и insert_records пишут в буфер, отправка — flush
+            self.buffer = WriteBuffer()
+            # листы по названию; список перечитывается только при промахе
+            self._worksheets = {}
+            self._sells_table = None
             logger.info("Успешное подключение к таблице")
         except Exception as e:
             logger.error(f"Ошибка при инициализации GoogleSheets: {e}")
             raise
 
+    def worksheet(self, title: str):
+        """Лист таблицы по названию из кэша или None, если такого листа нет"""
+        ws = self._worksheets.get(title)
+        if ws is None:
+            self._worksheets = {ws.title: ws for ws in self.table.worksheets()}
+            ws = self._worksheets.get(title)
+        return ws
+
+    def invalidate_sheets(self):
+        self._worksheets = {}
+
     def get_sheet(self, today, month):
-        try:
-            sheet_name = f'{sg.MONTH[month]}_ОП {today.year}'
-            ws = self.table.worksheet(sheet_name)
-            time.sleep(0.3)
-        except gspread.WorksheetNotFound as ex:
-            logger.warning(f'Лист {sheet_name} не найден. Ошибка: {ex}')
+        sheet_name = f'{sg.MONTH[month]}_ОП {today.year}'
+        ws = self.worksheet(sheet_name)
+        if ws is None:
+            logger.warning(f'Лист {sheet_name} не найден')
             ws = self.create_worksheet(today)
-        except Exception as ex:
-            logger.warning(f'Ошибка получения листа: {ex}')
-            time.sleep(30)
-            ws = self.get_sheet(today)
         return ws
 
     def create_worksheet(self, today):
         try:
             shablon, month = sg.create_shablon(today)
             ws = self.table.add_worksheet(f'{sg.MONTH[month]}_ОП {today.year}', 64, 128)
+            self._worksheets[ws.title] = ws
             ws.insert_cols(shablon, value_input_option="USER_ENTERED")
             self.beutify_sheet(ws)
         except Exception as ex:
@@ -46,9 +57,10 @@ class GoogleSheets:
     
     def get_sells(self, today):
         try:
-            table = self.gc.open_by_key(os.getenv('sells_table'))
+            if self._sells_table is None:
+                self._sells_table = self.gc.open_by_key(os.getenv('sells_table'))
             sheet_name = f'{sg.MONTH[today.month].upper()} {today.year}'
-            ws = table.worksheet(sheet_name)
+            ws = self._sells_table.worksheet(sheet_name)
             margin = ws.find('КОЛ-ВО ОПЛАТ')
             row_id = margin.row - 1
             col_id = 2 + today.day
@@ -102,11 +114,10 @@ class GoogleSheets:
             ]
             col_data.extend(mop_row_data)
 
-        ws.update(
-            col_data,
-            f'{sg.convert_num_to_letters(col_id)}{5}:{sg.convert_num_to_letters(col_id)}{25}',
-            raw=False
-        )
+        # строку 10 (записи на эту дату) заполняет только insert_records
+        col = sg.convert_num_to_letters(col_id)
+        self.buffer.add(ws, f'{col}{5}:{col}{9}', col_data[:5])
+        self.buffer.add(ws, f'{col}{11}:{col}{25}', col_data[6:])
         logger.info(f'Добавлена статистика за день: {today} в столбец {sg.convert_num_to_letters(col_id)}')
     
     def insert_records(self, record_statistic: dict, day_count, start_day):
@@ -144,13 +155,22 @@ class GoogleSheets:
             week_num = month_data[month]['start_weeknum']
             ws = self.get_sheet(start_day, month)
             col_id = 5 + 2 * week_num + 7 * (week_num - 1) + start_day.isoweekday()
-            ws.update(
-                [month_data[month]['month']],
+            self.buffer.add(
+                ws,
                 f'{sg.convert_num_to_letters(col_id)}{10}:{sg.convert_num_to_letters(col_id + len(month_data[month]["month"]))}{10}',
-                raw=False
+                [month_data[month]['month']]
             )
             logger.info(f'Добавлена статистика за месяц: {sg.MONTH[month]} в диапазон {sg.convert_num_to_letters(col_id)}{9}:{sg.convert_num_to_letters(col_id + len(month_data[month]["month"]))}{9}')
     
+    def flush(self):
+        """Отправка всех накопленных записей одним запросом на таблицу"""
+        try:
+            self.buffer.flush()
+        except gspread.exceptions.APIError:
+            # лист могли удалить или переименовать: кэш листов перечитается
+            self.invalidate_sheets()
+            raise
+
     def beutify_sheet(self, ws: gspread.Worksheet):
         # MERGE CELLS
         ws.merge_cells('A1:B2')
@@ -428,17 +448,11 @@ class GoogleSheets:
         return ws
     
     def get_mop_sheet(self, today):
-        try:
-            sheet_name = f'{sg.MONTH[today.month]}_МОПы {today.year}'
-            ws = self.table.worksheet(sheet_name)
-            time.sleep(0.3)
-        except gspread.WorksheetNotFound as ex:
-            logger.warning(f'Лист {sheet_name} не найден. Ошибка: {ex}')
+        sheet_name = f'{sg.MONTH[today.month]}_МОПы {today.year}'
+        ws = self.worksheet(sheet_name)
+        if ws is None:
+            logger.warning(f'Лист {sheet_name} не найден')
             ws = self.create_worksheet(today)
-        except Exception as ex:
-            logger.warning(f'Ошибка получения листа: {ex}')
-            time.sleep(30)
-            ws = self.get_sheet(today)
         return ws
     
     def beautify_mop_sheet(self, ws: gspread.Worksheet):
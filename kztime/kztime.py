@@ -1,6 +1,9 @@
 from datetime import datetime, timedelta, timezone
 
 
+# Смещение местного времени (Алматы) от UTC в секундах
+UTC_OFFSET = 5 * 3600
+
 def get_local_datetime(ts: int = None):
     if not ts:
         return datetime.now(timezone(timedelta(hours=5)))
@@ -16,6 +19,16 @@ def get_today_info(dt: datetime = None):
     return start_ts, end_ts, today
 
 
+def get_day_start(ts: int) -> int:
+    """Начало местных суток (timestamp), в которые попадает ts"""
+    return get_today_info(get_local_datetime(ts))[0]
+
+
+def get_day_index(ts: int) -> int:
+    """Номер местных суток, в которые попадает ts (как day в daily_stats)"""
+    return (ts + UTC_OFFSET) // 86400
+
+
 def get_last_week_list() -> list:
     week = []
     today = get_local_datetime()
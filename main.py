@@ -4,144 +4,229 @@ import time
 from loguru import logger
 from dotenv import load_dotenv
 from schedule import repeat, run_pending, every
-from bs4 import BeautifulSoup
 
 from database import Database
-from database.models import Lead
+from database.models import LeadSnapshot
 from amocrm.models import User
-from amocrm import AmoCRMClient
-from kztime import get_today_info, get_last_week_list, get_local_datetime
+from amocrm.calls import CallsAnalytics
+from amocrm.fields import LEAD_FIELD_NAMES
+from amocrm import AmoCRMClient, MetadataCache, lead_fields
+from kztime import get_today_info, get_last_week_list, get_local_datetime, get_day_start, get_day_index, UTC_OFFSET
 from googlesheet.googlesheets import GoogleSheets
 
 
 COMMON_PIPE = int(os.getenv('common_pipe'))
 SUCCESS_PIPE = int(os.getenv('success_pipe'))
+# Как часто выполнять полную сверку сделок вместо инкрементальной (в секундах)
+FULL_SYNC_INTERVAL = int(os.getenv('full_sync_interval', 3600))
+# С приёмником вебхуков (python -m webhook) опрос нужен только для сверки,
+# и интервал можно увеличить
+POLLING_INTERVAL = int(os.getenv('polling_interval', 5))
+LEADS_WATERMARK = 'leads_updated_at'
+LEADS_FULL_SYNC = 'leads_full_sync_at'
+# Запас для водяного знака (в секундах): страницы загружаются не по порядку updated_at,
+# и сделка могла измениться уже после загрузки своей страницы
+WATERMARK_SKEW = int(os.getenv('watermark_skew', 60))
+# Как часто выгружать в таблицу все дни недели, а не только изменившиеся (в секундах)
+SHEETS_REFRESH_INTERVAL = int(os.getenv('sheets_refresh_interval', 6 * 3600))
+SHEETS_FULL_REFRESH = 'sheets_full_refresh_at'
+FIELD_ID_STATE = 'field_id:{}'
+
+# версия реестра статусов, по которой классифицированы сделки в БД
+classified_version = None
 
 
 async def start_db():
+    # id полей и статусы при старте загружаются из amo
+    amo_client.start_session()
     await db.check_tables()
+    # список пользователей из БД сразу доступен, а из amo обновится в фоне
+    managers = await db.get_managers()
+    if managers:
+        metadata.set('users', managers, stale=True)
+    # id полей, найденные в прошлый раз, доступны до первого ответа amo
+    lead_fields.update({
+        key: await db.get_sync_state(FIELD_ID_STATE.format(key)) for key in LEAD_FIELD_NAMES
+    })
+    await metadata.get('lead_fields')
     await set_statuses()
 
 
+async def load_users():
+    users_json = await amo_client.get_all_pages(amo_client.get_users, 'users')
+    users = [User.from_json(user_json) for user_json in users_json]
+    await db.save_managers(users)
+    return users
+
+
+async def load_lead_fields():
+    fields_json = await amo_client.get_all_pages(amo_client.get_lead_fields, 'custom_fields')
+    ids = lead_fields.resolve(fields_json)
+    # приёмник вебхуков берёт id полей из БД
+    for key, field_id in ids.items():
+        await db.set_sync_state(FIELD_ID_STATE.format(key), field_id)
+    return ids
+
+
+def pipeline_key(pipeline_id: int):
+    return f'pipeline:{pipeline_id}'
+
+
 async def set_statuses():
     async def set_pipline_statuses(pipeline_id: int, priority: bool):
         amo_client.start_session()
         try:
-            pipeline = await amo_client.get_pipeline(pipeline_id)
+            pipeline = await metadata.get(pipeline_key(pipeline_id))
             await db.insert_statuses(pipeline, priority)
         except Exception as ex:
             logger.error(f'Ошибка получения статусов воронки: {pipeline_id}. Ошибка: {ex}')
             raise Exception
-        finally:
-            await amo_client.close_session()
     await set_pipline_statuses(COMMON_PIPE, False)
     await set_pipline_statuses(SUCCESS_PIPE, True)
+    # ранги статусов могли измениться, а от них зависят "back"-метрики
+    await db.rebuild_daily_stats()
+    # после пересчёта в таблицу выгружается вся неделя
+    await db.set_sync_state(SHEETS_FULL_REFRESH, 0)
 
 
 async def get_user_list():
-    # получаем список пользователей
-    users_response = await amo_client.get_users()
-    users = users_response.get('_embedded', {}).get('users', [])
-    next_page_users = users_response.get('_links', {}).get('next', {}).get('href')
-    page = 2
-    if next_page_users:
-        while next_page_users:
-            next_users_response = await amo_client.get_users(page=page)
-            users.extend(next_users_response.get('_embedded', {}).get('users', []))
-            next_page_users = next_users_response.get('_links', {}).get('next', {}).get('href')
-            page += 1
-    hunters = []
-    for user_json in users:
-        user = User.from_json(user_json)
-        if user.group_id == int(os.getenv('group_id')):
-            hunters.append(user)
-    return hunters
+    # список пользователей берётся из кэша метаданных
+    users = await metadata.get('users')
+    return [user for user in users if user.group_id == int(os.getenv('group_id'))]
 
 
 async def get_mop_data(today, users):
+    # звонки выгружаются только за сегодня, поэтому страница запрашивается каждый цикл
     page = await amo_client.get_managers(today, users)
-    soup = BeautifulSoup(page, 'lxml')
-    divs = soup.find_all('div', class_='calls_analytics_row')
-    count = len(divs) - 3
-    total = divs[-1].find('div', class_='calls_analytics__calls_graph__all')
-    return count, total.text
+    analytics = CallsAnalytics.from_html(page)
+    logger.info(f'Звонки по менеджерам за {today.date()}: {analytics.managers}')
+    return analytics.count, analytics.total
 
 
-async def get_leads_records(start_ts: int):
-    records = {}
-    day_count = 0      
-    try:
-        response = await amo_client.get_records(start_ts)
-        leads: list = response.get('_embedded', {}).get('leads', [])
-        next_page = response.get('_links', {}).get('next', {}).get('href')
-        page = 2
-        if next_page:
-            while next_page:
-                next_response = await amo_client.get_records(start_ts, page=page)
-                leads.extend(next_response.get('_embedded', {}).get('leads', []))
-                next_page = next_response.get('_links', {}).get('next', {}).get('href')
-                page += 1
-        for lead in leads:
-            fields = lead.get('custom_fields_values')
-            for field in fields:
-                match field.get('field_name'):
-                    case 'Время встречи':
-                        record = field.get('values', [{}])[0].get('value', -1)
-                        local_record = get_local_datetime(record)
-                        if local_record.year not in records:
-                            records[local_record.year] = {}
-                        if local_record.month not in records[local_record.year]:
-                            records[local_record.year][local_record.month] = {}
-                        if local_record.day not in records[local_record.year][local_record.month]:
-                            day_count += 1
-                            records[local_record.year][local_record.month][local_record.day] = 0
-                        records[local_record.year][local_record.month][local_record.day] += 1
-    except Exception as ex:
-        logger.error(f'Ошибка обработки записей: {ex}')
-    return records, day_count
+async def chain_pages(pulls: list):
+    """Страницы нескольких выборок iter_pages подряд"""
+    for pages in pulls:
+        async for leads in pages:
+            yield leads
 
 
 async def polling_leads():
+    global classified_version
     amo_client.start_session()
     try:
+        # id кастомных полей перечитываются из amo по TTL кэша метаданных
+        await metadata.get('lead_fields')
         week = get_last_week_list()
-    
-        for i, _day in enumerate(week):
-            logger.info(f'Обработка дня: {_day}')
-            # Получение даты и воронок
-            ts_beg, ts_end, day = get_today_info(_day)
-            pipelines = [COMMON_PIPE, SUCCESS_PIPE]
-            # Получение сделок из БД
-            db_leads = await db.get_lead_ids(ts_beg, ts_end)
-            db_leads_deleted = await db.get_lead_ids(ts_beg, ts_end, deleted=True)
-            # Получение сделок из amo
-            leads_response : dict = await amo_client.get_leads(ts_beg, ts_end, pipelines)
-            leads = leads_response.get('_embedded', {}).get('leads', [])
-            next_page = leads_response.get('_links', {}).get('next', {}).get('href')
-            page = 2
-            if next_page:
-                while next_page:
-                    next_response = await amo_client.get_leads(ts_beg, ts_end, pipelines, page=page)
-                    leads.extend(next_response.get('_embedded', {}).get('leads', []))
-                    next_page = next_response.get('_links', {}).get('next', {}).get('href')
-                    page += 1
-            #Добавление и обновление сделок
-            resp_leads = set()
-            statuses = await db.get_statuses()
+        # Инкрементальная синхронизация: запрашиваем только сделки, изменённые
+        # после последнего запуска. Полная сверка нужна, чтобы заметить сделки,
+        # удалённые в amo, и выполняется раз в FULL_SYNC_INTERVAL
+        watermark = await db.get_sync_state(LEADS_WATERMARK)
+        last_full_sync = await db.get_sync_state(LEADS_FULL_SYNC)
+        cycle_started_at = int(time.time())
+        statuses = await db.get_statuses()
+        full_sync = (
+            watermark is None or
+            last_full_sync is None or
+            cycle_started_at - last_full_sync >= FULL_SYNC_INTERVAL or
+            # после смены рангов статусов переклассифицируются все сделки окна,
+            # а инкрементальный цикл получает только изменённые
+            classified_version != statuses.version
+        )
+        max_updated_at = watermark or 0
+        logger.info(f'Режим синхронизации: {"полный" if full_sync else f"с updated_at >= {watermark}"}')
+
+        days = [get_today_info(_day) for _day in week]
+        window_beg, window_end = days[-1][0], days[0][1]
+        pipelines = [COMMON_PIPE, SUCCESS_PIPE]
+        # Получение сделок из БД: id → updated_at одним запросом
+        db_versions = await db.get_lead_versions(window_beg, window_end)
+        db_leads = set(db_versions)
+        # Получение сделок из amo
+        pulls = []
+        if full_sync:
+            # вся неделя одним запросом: по разнице с БД видны удалённые сделки
+            pulls.append(amo_client.iter_pages(
+                amo_client.get_leads, 'leads', window_beg, window_end, pipelines
+            ))
+        if watermark is not None:
+            # всё, что изменилось с прошлого цикла, без фильтра по дате создания:
+            # у сделок старше недели может появиться или сдвинуться время встречи.
+            # Без фильтра по воронкам, чтобы увидеть сделки, ушедшие в другую воронку
+            pulls.append(amo_client.iter_pages(
+                amo_client.get_leads, 'leads', None, None, [], updated_from=watermark
+            ))
+        else:
+            # первый запуск: сделки общей воронки со встречами с начала недели
+            pulls.append(amo_client.iter_pages(amo_client.get_records, 'leads', window_beg))
+        skip_unchanged = classified_version == statuses.version
+        resp_leads = set()
+        day_counts = {ts_beg: 0 for ts_beg, _, _ in days}
+        # Сделки обрабатываются постранично, пока загружаются следующие страницы
+        moved_leads = set()
+        # сделки вне окна, ушедшие из воронок: есть ли они в БД, проверяется в конце
+        moved_outside = set()
+        seen = set()
+        changed = 0
+        async for leads in chain_pages(pulls):
+            page_leads = []
             for lead_json in leads:
-                lead = Lead.from_json(lead_json, statuses)
+                if lead_json.get('id') in seen:
+                    continue
+                seen.add(lead_json.get('id'))
+                max_updated_at = max(max_updated_at, lead_json.get('updated_at') or 0)
+                day_start = get_day_start(lead_json.get('created_at'))
+                if day_start in day_counts:
+                    day_counts[day_start] += 1
+                # Сделка не менялась с прошлой записи: классификация и запись не нужны
+                if (
+                    skip_unchanged and
+                    lead_json.get('pipeline_id') in pipelines and
+                    db_versions.get(lead_json.get('id'), -1) == lead_json.get('updated_at')
+                ):
+                    resp_leads.add(lead_json['id'])
+                    continue
+                #Добавление и обновление сделок
+                lead = LeadSnapshot.from_json(lead_json, statuses)
+                if lead.pipeline not in pipelines:
+                    if lead.id in db_leads:
+                        moved_leads.add(lead.id)
+                    elif day_start not in day_counts:
+                        moved_outside.add(lead.id)
+                    continue
                 resp_leads.add(lead.id)
-                if lead.id not in db_leads:
-                    if lead.id not in db_leads_deleted:
-                        await db.add_lead(lead)
-                await db.update_lead(lead)
-            # "Удаляем" сделки, которые ушли в другую воронку
-            diff_leads = db_leads - resp_leads
-            for lead in diff_leads:
-                await db.delete_lead(lead)
+                page_leads.append(lead)
+                changed += 1
+            if page_leads:
+                await db.upsert_leads(page_leads)
+        logger.info(f'Сделок из amo: {sum(day_counts.values())}, изменённых: {changed}')
+        for ts_beg, _, day in days:
+            logger.info(f'Обработан день: {day}, сделок из amo: {day_counts[ts_beg]}')
+        # "Удаляем" сделки, которые ушли в другую воронку
+        if full_sync:
+            moved_leads |= db_leads - resp_leads
+        if moved_outside:
+            moved_leads |= await db.get_existing_lead_ids(list(moved_outside))
+        await db.mark_deleted(moved_leads)
+
+        # В таблицу выгружаются только сутки, где что-то изменилось, и сегодняшние
+        # (в них ещё звонки менеджеров); раз в SHEETS_REFRESH_INTERVAL — вся неделя
+        sheets_refreshed_at = await db.get_sync_state(SHEETS_FULL_REFRESH)
+        full_refresh = (
+            sheets_refreshed_at is None or
+            cycle_started_at - sheets_refreshed_at >= SHEETS_REFRESH_INTERVAL
+        )
+        dirty_stats = await db.get_dirty_days('stats')
+        dirty_records = await db.get_dirty_days('records')
+        stat_days = [
+            (ts_beg, ts_end, day) for i, (ts_beg, ts_end, day) in enumerate(days)
+            if full_refresh or i == 0 or get_day_index(ts_beg) in dirty_stats
+        ]
+        logger.info(f'Выгрузка статистики за дни: {[day.date().isoformat() for _, _, day in stat_days]}')
+        statistics = await db.get_statistics(stat_days)
+        for ts_beg, ts_end, day in stat_days:
             # Отправка в гугл
-            statistic = await db.get_statistic(ts_beg, ts_end)
-            if i == 0:
+            statistic = statistics[day]
+            if ts_beg == days[0][0]:
                 # Получаем данные о звонках
                 users = await get_user_list()
                 mop_data = await get_mop_data(day, users)
@@ -149,22 +234,42 @@ async def polling_leads():
             else:
                 google.insert_statistic(statistic, day)
         start_ts, _, last_day = get_today_info(week[-1])
-        record_statistic, day_count = await get_leads_records(start_ts)
-        google.insert_records(record_statistic, day_count, last_day)
+        record_days = [day for day in dirty_records if day >= get_day_index(start_ts)]
+        if not full_refresh and record_days:
+            # встречи переписываются начиная с первых изменившихся суток
+            start_ts, _, last_day = get_today_info(get_local_datetime(min(record_days) * 86400 - UTC_OFFSET))
+        if full_refresh or record_days:
+            record_statistic, day_count = await db.get_records(start_ts, COMMON_PIPE)
+            google.insert_records(record_statistic, day_count, last_day)
+        # все диапазоны цикла уходят в таблицу одним запросом
+        google.flush()
+        await db.clear_dirty_days('stats', dirty_stats)
+        await db.clear_dirty_days('records', dirty_records)
+        if full_refresh:
+            await db.set_sync_state(SHEETS_FULL_REFRESH, cycle_started_at)
+        # водяной знак сдвигается только после успешного цикла и не дальше начала
+        # цикла: фильтр по updated_at включает границу, повторно придут лишь несколько сделок
+        watermark = max(watermark or 0, min(max_updated_at, cycle_started_at - WATERMARK_SKEW))
+        await db.set_sync_state(LEADS_WATERMARK, watermark)
+        if full_sync:
+            await db.set_sync_state(LEADS_FULL_SYNC, cycle_started_at)
+            classified_version = statuses.version
     except Exception as ex:
         logger.error(f'Не получилось получить сделки. Ошибка: {ex}')
     finally:
-        await amo_client.close_session()
+        amo_client.log_connection_stats()
 
 
 @repeat(every().week)
 def update_statuses():
-    asyncio.run(set_statuses())
+    for pipeline_id in (COMMON_PIPE, SUCCESS_PIPE):
+        metadata.invalidate(pipeline_key(pipeline_id))
+    loop.run_until_complete(set_statuses())
 
 
-@repeat(every(5).minutes)
+@repeat(every(POLLING_INTERVAL).minutes)
 def main():
-    asyncio.run(polling_leads())
+    loop.run_until_complete(polling_leads())
 
 
 if __name__ == '__main__':
@@ -192,11 +297,36 @@ if __name__ == '__main__':
         access_token=os.getenv("access_token"),
         client_id=os.getenv("client_id"),
         client_secret=os.getenv("client_secret"),
-        permanent_access_token=True
+        permanent_access_token=True,
+        connection_limit=int(os.getenv('amo_connection_limit', 10)),
+        keepalive_timeout=float(os.getenv('amo_keepalive_timeout', 75)),
+        dns_cache_ttl=int(os.getenv('amo_dns_cache_ttl', 600)),
+        accept_compression=os.getenv('amo_accept_compression', '1') == '1',
+        # теги сделок не используются, а проекция оставляет только поля для классификации
+        with_tags=os.getenv('amo_with_tags', '0') == '1',
+        project_leads=os.getenv('amo_project_leads', '1') == '1'
     )
 
     db = Database()
-    asyncio.run(start_db())
-    while True:
-        run_pending()
-        time.sleep(1)
+
+    metadata = MetadataCache(ttl=int(os.getenv('metadata_ttl', 6 * 3600)))
+    metadata.register('users', load_users)
+    metadata.register('lead_fields', load_lead_fields)
+    for pipeline_id in (COMMON_PIPE, SUCCESS_PIPE):
+        metadata.register(
+            pipeline_key(pipeline_id),
+            lambda pipeline_id=pipeline_id: amo_client.get_pipeline(pipeline_id)
+        )
+    # Один цикл событий на всё время работы, чтобы HTTP-сессия и пул
+    # соединений AmoCRM переживали 5-минутные циклы опроса
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(start_db())
+    try:
+        while True:
+            run_pending()
+            time.sleep(1)
+    finally:
+        loop.run_until_complete(amo_client.close_session())
+        loop.run_until_complete(db.dispose())
+        loop.close()
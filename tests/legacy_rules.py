@@ -0,0 +1,102 @@
+"""Правила классификации сделок до компиляции в таблицу (database/models.py и
+Database.get_statuses в исходной ревизии). Код перенесён без изменений, кроме
+того, что Lead здесь не ORM-модель; служит эталоном в test_classifier.py"""
+import os
+from loguru import logger
+
+
+def legacy_statuses(rows) -> dict:
+    """Database.get_statuses: rows — строки таблицы status (id, status_id, pipeline_id, name, sort_type)"""
+    st_dict = {}
+    for status in rows:
+        _, status_id, pipeline_id, name, sort_type = status
+        if pipeline_id not in st_dict:
+            st_dict[pipeline_id] = {}
+        st_dict[pipeline_id][status_id] = sort_type
+    return st_dict
+
+
+class Lead:
+
+    def __get_value_from_json(self, field: dict, _all: bool = False) -> str:
+        """Приватный метод для получения значения из JSON"""
+        try:
+            if not _all:
+                value = (
+                    field["values"][0]["value"]
+                    if field["values"][0]["value"] is not None
+                    else ""
+                )
+            else:
+                value = ", ".join(
+                    [
+                        value["value"]
+                        for value in field["values"]
+                        if value["value"] is not None
+                    ]
+                )
+            logger.debug(f"{field.get('field_name','Неизвестное')}: {value}")
+            return value
+        except (KeyError, IndexError, TypeError) as e:
+            logger.warning(
+                f"Ошибка при обработке поля `{field.get('field_name','Неизвестное')}`: {e}"
+            )
+            return "не заполнено"
+
+    @classmethod
+    def from_json(cls, json_data: dict, statuses: dict):
+        self : Lead = cls()
+        self.id = json_data.get('id', '')
+        self.status = json_data.get('status_id', '')
+        self.pipeline = json_data.get('pipeline_id', '')
+        self.created_at = json_data.get('created_at', '')
+        self.updated_at = json_data.get('updated_at', '')
+        self.recorded_at = None
+        reject_reason = ''
+        self.is_deleted = False
+        self.is_record = False
+        self.is_meeting = False
+        self.is_selled = False
+        self.is_qual = False
+
+        fields = json_data.get('custom_fields_values', [])
+        if not fields:
+            fields = [] 
+        for field in fields:
+            match field.get("field_name", None):
+                case 'Время встречи':
+                    self.is_record = True
+                    self.recorded_at = self.__get_value_from_json(field)
+                case 'ЗНР причина':
+                    reject_reason = self.__get_value_from_json(field)
+                case _:
+                    continue
+        if (
+            statuses.get(self.pipeline, {}).get(self.status, -1) >= statuses.get(int(os.getenv('common_pipe')), {}).get(int(os.getenv('qual_status', 50))) and 
+            statuses.get(self.pipeline, {}).get(self.status, -1) != 11000
+        ) or (
+            statuses.get(self.pipeline, {}).get(self.status, -1) == 11000 and
+            reject_reason not in ['Не прошли квал', 'НД'] 
+        ):
+            self.is_qual = True
+        if (
+            self.status == int(os.getenv('decision_status'))
+        ) or (
+            (
+                statuses.get(self.pipeline, {}).get(self.status, -1) >= statuses.get(int(os.getenv('common_pipe')), {}).get(int(os.getenv('decision_status')), 80)
+            ) and (
+                reject_reason not in ['Не прошли квал', 'НД', 'Записались на встречу, но слились']
+            )
+        ):
+            self.is_meeting = True
+        if statuses.get(self.pipeline, {}).get(self.status, -1) > 100000:
+            self.is_selled = True
+
+        if self.is_selled:
+            self.is_meeting = True
+        if self.is_meeting:
+            self.is_record = True
+        if self.is_record:
+            self.is_qual = True
+        
+        return self
@@ -0,0 +1,62 @@
+import json
+import pytest
+from pathlib import Path
+
+from amocrm.fields import lead_fields
+from database.models import Status
+from database.registry import StatusRegistry
+from database.columnar import LeadColumns
+from database.classifier import (
+    get_classifier, classify_reference, load_corpus, QUAL, RECORD, MEETING, SELLED
+)
+from tests.legacy_rules import Lead as LegacyLead, legacy_statuses
+
+
+DATA = Path(__file__).parent / 'data'
+COMMON_PIPE, SUCCESS_PIPE = 5001, 5002
+
+
+@pytest.fixture
+def statuses(monkeypatch):
+    monkeypatch.setenv('common_pipe', str(COMMON_PIPE))
+    monkeypatch.setenv('qual_status', '13')
+    monkeypatch.setenv('decision_status', '15')
+    monkeypatch.setitem(lead_fields.ids, 'record', 693664)
+    monkeypatch.setitem(lead_fields.ids, 'reject_reason', 700100)
+    rows = []
+    for pipeline in json.loads((DATA / 'pipelines.json').read_text(encoding='utf8')):
+        for status_json in pipeline['_embedded']['statuses']:
+            status = Status.from_json(status_json, pipeline['id'] == SUCCESS_PIPE)
+            if status.sort_type != -1:
+                rows.append((len(rows) + 1, status.status_id, status.pipeline_id, status.name, status.sort_type))
+    registry = StatusRegistry()
+    registry.load([row[1:] for row in rows])
+    return registry, legacy_statuses(rows)
+
+
+def legacy_flags(lead: LegacyLead) -> int:
+    return (
+        (QUAL if lead.is_qual else 0) | (RECORD if lead.is_record else 0) |
+        (MEETING if lead.is_meeting else 0) | (SELLED if lead.is_selled else 0)
+    )
+
+
+def test_rules_match_legacy_classification(statuses):
+    registry, legacy = statuses
+    leads = load_corpus(DATA / 'leads.json')
+    classifier = get_classifier(registry)
+    columns = LeadColumns.from_leads(leads)
+    column_flags = columns.classify(registry)
+    for lead_json, (flags, recorded_at), column in zip(leads, classifier.classify_batch(leads), column_flags):
+        expected = LegacyLead.from_json(lead_json, legacy)
+        assert flags == legacy_flags(expected), lead_json['id']
+        assert recorded_at == expected.recorded_at, lead_json['id']
+        assert classify_reference(lead_json, registry) == flags, lead_json['id']
+        assert int(column) == flags, lead_json['id']
+
+
+def test_corpus_covers_every_flag(statuses):
+    registry, _ = statuses
+    leads = load_corpus(DATA / 'leads.json')
+    seen = {flags for flags, _ in get_classifier(registry).classify_batch(leads)}
+    assert {0, QUAL, QUAL | RECORD, QUAL | RECORD | MEETING, QUAL | RECORD | MEETING | SELLED} <= seen
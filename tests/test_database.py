@@ -0,0 +1,86 @@
+import asyncio
+import pytest
+
+from database import Database
+from database.models import LeadSnapshot
+
+
+PIPELINE = {
+    'id': 1,
+    '_embedded': {
+        'statuses': [
+            {'id': 1, 'pipeline_id': 1, 'name': 'Новая', 'sort': 10},
+            {'id': 3, 'pipeline_id': 1, 'name': 'Квалификация пройдена', 'sort': 30},
+            {'id': 5, 'pipeline_id': 1, 'name': 'Принимает решение', 'sort': 50},
+        ]
+    }
+}
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setenv('db_url', f"sqlite+aiosqlite:///{tmp_path / 'test.db'}")
+    database = Database()
+    asyncio.run(database.check_tables())
+    asyncio.run(database.insert_statuses(PIPELINE))
+    yield database
+    asyncio.run(database.dispose())
+
+
+def lead(status_id: int, updated_at: int, flags: int = 0) -> LeadSnapshot:
+    return LeadSnapshot(1, status_id, 1, 1760000000, updated_at, None, flags)
+
+
+async def stored_lead(db: Database) -> dict:
+    async with db.async_session() as session:
+        rows = await db._select_stat_rows(session, [1])
+    return rows[1]
+
+
+def test_upsert_moves_status_up(db):
+    asyncio.run(db.upsert_leads([lead(1, 1)]))
+    asyncio.run(db.upsert_leads([lead(5, 2)]))
+    assert int(asyncio.run(stored_lead(db))['status']) == 5
+
+
+def test_upsert_keeps_higher_status(db):
+    asyncio.run(db.upsert_leads([lead(5, 1)]))
+    asyncio.run(db.upsert_leads([lead(3, 2)]))
+    assert int(asyncio.run(stored_lead(db))['status']) == 5
+
+
+def test_upsert_second_lead_does_not_fail(db):
+    other = LeadSnapshot(2, 1, 1, 1760000000, 1, None, 0)
+    asyncio.run(db.upsert_leads([lead(1, 1), other]))
+    asyncio.run(db.upsert_leads([lead(3, 2), other]))
+    assert int(asyncio.run(stored_lead(db))['status']) == 3
+
+
+def test_concurrent_insert_counts_lead_once(db, tmp_path):
+    async def run():
+        other = Database()
+        try:
+            await asyncio.gather(*(
+                database.upsert_leads([lead(1, 1)]) for database in (db, other, db, other)
+            ))
+        finally:
+            await other.dispose()
+        return await db.get_statistic(1760000000, 1760000000 + 86399)
+
+    assert asyncio.run(run())[0] == 1
+
+
+def test_status_change_in_other_process_reloads_registry(db):
+    async def run():
+        other = Database()
+        try:
+            before = (await other.get_statuses()).rank(1, 5)
+            await db.insert_statuses({
+                'id': 1,
+                '_embedded': {'statuses': [{'id': 5, 'pipeline_id': 1, 'name': 'Принимает решение', 'sort': 70}]}
+            })
+            return before, (await other.get_statuses()).rank(1, 5)
+        finally:
+            await other.dispose()
+
+    assert asyncio.run(run()) == (50, 70)
@@ -0,0 +1,34 @@
+import asyncio
+from urllib.parse import urlencode
+from aiohttp.test_utils import TestClient, TestServer
+
+from webhook import WebhookReceiver
+from webhook.parser import parse_lead_events
+
+
+def body(**lead) -> str:
+    return urlencode({f'leads[update][0][{key}]': value for key, value in lead.items()})
+
+
+def test_event_without_created_at_is_skipped():
+    events = parse_lead_events(
+        body(id=1, status_id=2, pipeline_id=3, updated_at=5) + '&' +
+        urlencode({'leads[delete][0][id]': 7})
+    )
+    assert events == [('delete', {'id': 7})]
+
+
+def test_wrong_secret_is_rejected():
+    async def run():
+        receiver = WebhookReceiver(db=None, pipelines=[3], secret='s3cret')
+        app = receiver.create_app()
+        app.on_startup.clear()
+        app.on_cleanup.clear()
+        async with TestClient(TestServer(app)) as client:
+            data = body(id=1, status_id=2, pipeline_id=3, created_at=4, updated_at=5)
+            headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+            wrong = await client.post('/amocrm/leads/guess', data=data, headers=headers)
+            right = await client.post('/amocrm/leads/s3cret', data=data, headers=headers)
+            return wrong.status, right.status, receiver.queue.qsize()
+
+    assert asyncio.run(run()) == (403, 200, 1)
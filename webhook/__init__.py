@@ -0,0 +1 @@
+from .receiver import WebhookReceiver
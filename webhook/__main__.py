@@ -0,0 +1,26 @@
+import os
+from aiohttp import web
+from dotenv import load_dotenv
+from loguru import logger
+
+from database import Database
+from webhook import WebhookReceiver
+
+
+if __name__ == '__main__':
+    load_dotenv()
+    receiver = WebhookReceiver(
+        Database(),
+        pipelines=[int(os.getenv('common_pipe')), int(os.getenv('success_pipe'))],
+        # адрес вебхука в amoCRM: https://<хост>/amocrm/leads/<webhook_secret>
+        secret=os.getenv('webhook_secret'),
+        queue_size=int(os.getenv('webhook_queue_size', 10000)),
+        batch_size=int(os.getenv('webhook_batch_size', 200)),
+        record_dir=os.getenv('webhook_record_dir')
+    )
+    logger.info('Запуск приёмника вебхуков amoCRM')
+    web.run_app(
+        receiver.create_app(),
+        host=os.getenv('webhook_host', '0.0.0.0'),
+        port=int(os.getenv('webhook_port', 8080))
+    )
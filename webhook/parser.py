@@ -0,0 +1,91 @@
+import re
+from loguru import logger
+from urllib.parse import parse_qsl
+
+
+KEY_PART = re.compile(r'\[([^\]]*)\]')
+LEAD_EVENTS = ('add', 'update', 'status', 'delete')
+# без этих полей сделку нельзя записать в таблицу lead (NOT NULL)
+REQUIRED_FIELDS = ('id', 'status_id', 'pipeline_id', 'created_at', 'updated_at')
+
+
+def _set_path(tree: dict, path: list, value: str):
+    node = tree
+    for part in path[:-1]:
+        node = node.setdefault(part, {})
+    node[path[-1]] = value
+
+
+def _to_lists(node):
+    """Словари с числовыми ключами ('0', '1', ...) превращаются в списки"""
+    if not isinstance(node, dict):
+        return node
+    if node and all(key.isdigit() for key in node):
+        return [_to_lists(node[key]) for key in sorted(node, key=int)]
+    return {key: _to_lists(value) for key, value in node.items()}
+
+
+def parse_form(pairs) -> dict:
+    """Разбор тела вебхука amoCRM вида leads[status][0][id]=1 во вложенный словарь"""
+    tree = {}
+    for key, value in pairs:
+        head = key.split('[', 1)[0]
+        _set_path(tree, [head] + KEY_PART.findall(key), value)
+    return _to_lists(tree)
+
+
+def _int(value, default=None):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _value(value):
+    return _int(value, value) if isinstance(value, str) else value
+
+
+def normalize_lead(data: dict) -> dict:
+    """Приводит сделку из вебхука к формату ответа /api/v4/leads,
+    который понимает LeadSnapshot.from_json"""
+    fields = []
+    for field in data.get('custom_fields') or []:
+        values = [
+            {'value': _value(value.get('value'))} if isinstance(value, dict) else {'value': _value(value)}
+            for value in field.get('values') or []
+        ]
+        fields.append({
+            'field_id': _int(field.get('id')),
+            'field_name': field.get('name'),
+            'values': values
+        })
+    return {
+        'id': _int(data.get('id')),
+        'status_id': _int(data.get('status_id')),
+        'pipeline_id': _int(data.get('pipeline_id')),
+        'created_at': _int(data.get('created_at') or data.get('date_create')),
+        'updated_at': _int(data.get('updated_at') or data.get('last_modified')),
+        'custom_fields_values': fields or None
+    }
+
+
+def parse_lead_events(body: str) -> list:
+    """Возвращает список событий (тип, сделка) из тела вебхука"""
+    payload = parse_form(parse_qsl(body, keep_blank_values=True))
+    leads = payload.get('leads', {})
+    events = []
+    for event in LEAD_EVENTS:
+        for lead in leads.get(event, []):
+            if event == 'delete':
+                lead_json = {'id': _int(lead.get('id'))}
+                required = ('id',)
+            else:
+                lead_json = normalize_lead(lead)
+                required = REQUIRED_FIELDS
+            missing = [field for field in required if lead_json.get(field) is None]
+            if missing:
+                # событие пропускается, остальные из вебхука применяются
+                logger.warning(f"Событие {event} по сделке {lead_json.get('id')} без полей {missing}, пропущено")
+                continue
+            events.append((event, lead_json))
+    return events
@@ -0,0 +1,150 @@
+import os
+import hmac
+import time
+import asyncio
+from aiohttp import web
+from loguru import logger
+
+from database import Database
+from database.models import LeadSnapshot
+from amocrm.fields import lead_fields, LEAD_FIELD_NAMES
+from webhook.parser import parse_lead_events
+
+
+class WebhookReceiver:
+    """Приём вебхуков amoCRM по сделкам и пакетная запись изменений в БД"""
+
+    def __init__(
+        self,
+        db: Database,
+        pipelines: list,
+        secret: str,
+        queue_size: int = 10000,
+        batch_size: int = 200,
+        batch_timeout: float = 1.0,
+        record_dir: str = None
+    ):
+        if not secret:
+            raise ValueError('Не задан секрет приёмника вебхуков')
+        self.db = db
+        self.secret = secret
+        self.pipelines = pipelines
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.record_dir = record_dir
+        self._worker: asyncio.Task = None
+        self._fields_loaded_at = 0.0
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        # секрет передаётся в пути: amoCRM не умеет добавлять заголовки к вебхукам
+        app.router.add_post('/amocrm/leads/{secret}', self.handle)
+        app.on_startup.append(self._start_worker)
+        app.on_cleanup.append(self._stop_worker)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.match_info['secret'], self.secret):
+            logger.warning(f'Вебхук с неверным секретом от {request.remote}')
+            return web.Response(status=403)
+        body = await request.text()
+        if self.record_dir:
+            self._record(body)
+        try:
+            events = parse_lead_events(body)
+        except Exception as ex:
+            logger.error(f'Не удалось разобрать вебхук: {ex}')
+            return web.Response(status=400)
+        for event in events:
+            try:
+                self.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # amoCRM повторит запрос, а пропущенное подберёт сверка опросом
+                logger.warning('Очередь вебхуков переполнена, событие отклонено')
+                return web.Response(status=503)
+        logger.debug(f'Принято событий из вебхука: {len(events)}')
+        return web.Response(text='ok')
+
+    def _record(self, body: str):
+        os.makedirs(self.record_dir, exist_ok=True)
+        path = os.path.join(self.record_dir, f'{time.time_ns()}.txt')
+        with open(path, 'w', encoding='utf8') as file:
+            file.write(body)
+
+    async def _start_worker(self, app: web.Application):
+        await self.load_field_ids()
+        self._worker = asyncio.create_task(self.run_worker())
+
+    async def load_field_ids(self):
+        """id кастомных полей находит основной процесс и сохраняет в sync_state"""
+        lead_fields.update({
+            key: await self.db.get_sync_state(f'field_id:{key}') for key in LEAD_FIELD_NAMES
+        })
+        self._fields_loaded_at = time.monotonic()
+
+    async def _stop_worker(self, app: web.Application):
+        self._worker.cancel()
+        await asyncio.gather(self._worker, return_exceptions=True)
+        await self.db.dispose()
+
+    async def _next_batch(self) -> list:
+        batch = [await self.queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.batch_timeout
+        while len(batch) < self.batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run_worker(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self.apply_batch(batch)
+            except Exception as ex:
+                logger.error(f'Ошибка применения пакета вебхуков: {ex}, применение по одному событию')
+                await self.apply_each(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def apply_each(self, batch: list):
+        """Применение событий по одному, чтобы одно ошибочное не теряло весь пакет"""
+        for event in batch:
+            try:
+                await self.apply_batch([event])
+            except Exception as ex:
+                logger.error(f"Событие {event[0]} по сделке {event[1].get('id')} не применено: {ex}")
+
+    async def apply_batch(self, batch: list):
+        # по каждой сделке достаточно последнего события в пакете
+        latest = {}
+        for event, lead_json in batch:
+            if lead_json.get('id') is not None:
+                latest[lead_json['id']] = (event, lead_json)
+        # статусы обновляет основной процесс; реестр перечитывается после их изменения
+        statuses = await self.db.get_statuses()
+        if time.monotonic() - self._fields_loaded_at > 3600:
+            await self.load_field_ids()
+        existing = await self.db.get_existing_lead_ids(list(latest))
+        leads, deleted = [], set()
+        for lead_id, (event, lead_json) in latest.items():
+            if event == 'delete':
+                if lead_id in existing:
+                    deleted.add(lead_id)
+                continue
+            lead = LeadSnapshot.from_json(lead_json, statuses)
+            if lead.pipeline not in self.pipelines:
+                # сделка ушла в другую воронку
+                if lead_id in existing:
+                    deleted.add(lead_id)
+                continue
+            leads.append(lead)
+        await self.db.upsert_leads(leads)
+        await self.db.mark_deleted(deleted)
+        logger.info(f'Применено событий из вебхуков: {len(latest)}')
@@ -0,0 +1,30 @@
+import os
+import sys
+import asyncio
+import aiohttp
+from dotenv import load_dotenv
+from pathlib import Path
+from loguru import logger
+
+
+async def replay(path: str, url: str):
+    """Повторная отправка записанных тел вебхуков (файл или каталог) на приёмник"""
+    path = Path(path)
+    files = sorted(path.iterdir()) if path.is_dir() else [path]
+    async with aiohttp.ClientSession() as session:
+        for file in files:
+            async with session.post(
+                url,
+                data=file.read_text(encoding='utf8'),
+                headers={'Content-Type': 'application/x-www-form-urlencoded'}
+            ) as response:
+                logger.info(f'{file.name}: статус {response.status}')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Использование: python -m webhook.replay <файл|каталог> [url]')
+        sys.exit(1)
+    load_dotenv()
+    url = sys.argv[2] if len(sys.argv) > 2 else f"http://localhost:8080/amocrm/leads/{os.getenv('webhook_secret')}"
+    asyncio.run(replay(sys.argv[1], url))